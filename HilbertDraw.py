@@ -6,6 +6,19 @@ Author : Matthew McGonagle
 
 import numpy as np
 import random
+import threading
+import queue
+import concurrent.futures
+import collections
+import json
+import os
+import socket
+import socketserver
+import time
+import types
+import math
+import tempfile
+import weakref
 
 class SquareSymmetry:
     '''
@@ -22,8 +35,13 @@ class SquareSymmetry:
         self.reflection : Int
             Represents whether there is a reflection. Has value 0 for NO reflection and value 1 if there
             is a reflection.
+        self.childtable : Dictionary
+            Class member shared by all symmetries. Maps each (rotation, reflection) to the list of the 
+            symmetries of the four children, see childsymmetries.
     '''
 
+    childtable = {}
+
     def __init__(self, rotation, reflection):
         '''
         Initializer
@@ -64,6 +82,29 @@ class SquareSymmetry:
         newrotation = (newrotation + self.rotation) % 4
         return SquareSymmetry(newrotation, newreflection)
 
+    def childsymmetries(self):
+        '''
+        The symmetries of the four children of a square with this symmetry, in curve order. They are only
+        computed once for each of the 8 symmetries and then looked up in SquareSymmetry.childtable, so
+        the children of many nodes share the same symmetry instances.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+
+        Returns
+        -------
+        List of SquareSymmetry
+            The four symmetries. The middle two are the same as self.
+        '''
+        key = (self.rotation, self.reflection)
+        children = SquareSymmetry.childtable.get(key)
+        if children is None:
+            children = [self.times(SquareSymmetry(3,1)), self, self, self.times(SquareSymmetry(1,1))]
+            SquareSymmetry.childtable[key] = children
+        return children
+
     def getreflection(self):
         '''
         Return the reflection.
@@ -146,8 +187,13 @@ class HilbertTree:
         The level of Hilbert pseudo-curve this node is on, i.e. the height from the root node. 
     self.children : List of HilbertTree
         The sub-squares of this square that are a part of the next level of Hilbert pseudo-curve.
+    self.buildstack : List
+        The nodes still to visit when generatechildren has been paused, else None. This is a class
+        member until it is first set, so it doesn't take any memory in every node.
     '''
 
+    buildstack = None
+
     def __init__(self, symmetry, level):
         '''
         Initializer
@@ -166,44 +212,59 @@ class HilbertTree:
         self.level = level
         self.children = []
 
-    def generatechildren(self, numlevels):
+    def generatechildren(self, numlevels, maxsteps = None):
         '''
         Create children of this node. The children are part of the Hilbert pseudo-curve at the next level
         and make by dividing this square into an even 2x2 grid of sub-squares. They inherit orientations
         in a certain way from the orientation of this node.
 
-        The function continues to recurse down the tree (depth first) to create a certain number of levels.
+        The function continues down the tree (depth first) to create a certain number of levels. This uses
+        an explicit stack instead of recursion, so the traversal can be paused after maxsteps nodes and
+        resumed by calling generatechildren again.
         Parameters
         ----------
         self : self
             Implicit reference to self.
         numlevels: Int
             The number of levels to create. Function will not beyond numlevels. 
-        '''
-        if self.level > numlevels:
-            return
-        elif self.children:
-            return
-
-        newlevel = self.level + 1
-        newsymmetry = self.symmetry.times(SquareSymmetry(3,1))
-        self.children.append(HilbertTree(newsymmetry, newlevel))
-
-        newsymmetry = self.symmetry
-        self.children.append(HilbertTree(newsymmetry, newlevel))
-        self.children.append(HilbertTree(newsymmetry, newlevel))
+        maxsteps : Int
+            The maximum number of nodes to visit before pausing. If None, then never pause.
 
-        newsymmetry = self.symmetry.times(SquareSymmetry(1,1))
-        self.children.append(HilbertTree(newsymmetry, newlevel))
+        Returns
+        -------
+        Bool
+            True if the tree is finished, or False if the traversal was paused.
+        '''
+        stack = self.buildstack if self.buildstack is not None else [self]
+        self.buildstack = None
+        steps = 0
+        while stack:
+            if steps == maxsteps:
+                self.buildstack = stack
+                return False
+            node = stack.pop()
+            steps += 1
+            if node.level > numlevels or node.children:
+                continue
 
-        for i in range(4):
-            self.children[i].generatechildren(numlevels)
+            newlevel = node.level + 1
+            symmetries = node.symmetry.childsymmetries()
+            children = node.children
+            children.append(HilbertTree(symmetries[0], newlevel))
+            children.append(HilbertTree(symmetries[1], newlevel))
+            children.append(HilbertTree(symmetries[2], newlevel))
+            children.append(HilbertTree(symmetries[3], newlevel))
+            stack.append(children[3])
+            stack.append(children[2])
+            stack.append(children[1])
+            stack.append(children[0])
+        return True
 
     def generatepositions(self, currentlist, myposition, mywidth):
         '''
-        Recursively add the positions of the leaf sub-squares to a list of square positions. If
-        this node is a leaf, then add it to the list of positions. Else, use the position of this 
-        node to calculate the positions of the children and then recurse down.
+        Add the positions of the leaf sub-squares to a list of square positions. If a node is a leaf,
+        then add it to the list of positions. Else, use the position of the node to calculate the 
+        positions of the children and then go down to them. Uses an explicit stack instead of recursion.
 
         Parameters
         ----------
@@ -216,17 +277,57 @@ class HilbertTree:
         mywidth : Int
             The width of this square.
         '''
-        if not self.children:
-            currentlist.append(myposition)
-            return
-        newwidth = mywidth/2
-        offsets = [[0,0], [0,newwidth], [newwidth,newwidth], [newwidth,0]]
-        for i in range(4):
-            newi = self.symmetry.actindex(i)
-            newposition = myposition.copy()
-            for j in range(2):
-                newposition[j] += offsets[newi][j]
-            self.children[i].generatepositions(currentlist, newposition, newwidth) 
+        append = currentlist.append
+        # For each symmetry, the offset of each child, listed from the last child to the first.
+        offsetindices = [[SquareSymmetry(rotation, reflection).actindex(i) for i in range(3, -1, -1)]
+                         for rotation in range(4) for reflection in range(2)]
+        stack = [(self, myposition, mywidth)]
+        while stack:
+            (node, position, width) = stack.pop()
+            children = node.children
+            if not children:
+                append(position)
+                continue
+            newwidth = width/2
+            (x, y) = (position[0], position[1])
+            offsets = [[x, y], [x, y + newwidth], [x + newwidth, y + newwidth], [x + newwidth, y]]
+            symmetry = node.symmetry
+            newi = offsetindices[2 * symmetry.rotation + symmetry.reflection]
+            stack.append((children[3], offsets[newi[0]], newwidth))
+            stack.append((children[2], offsets[newi[1]], newwidth))
+            stack.append((children[1], offsets[newi[2]], newwidth))
+            stack.append((children[0], offsets[newi[3]], newwidth))
+
+    def iteratepositions(self, myposition, mywidth):
+        '''
+        Generator version of generatepositions. Yields the positions of the leaf sub-squares in order,
+        so the traversal can be paused and resumed.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        mypositions : Array-like
+            Has 2 elements; the xy position of this square.
+        mywidth : Int
+            The width of this square.
+
+        Returns
+        -------
+        Generator of Array-like
+            The positions of the leaves in curve order.
+        '''
+        stack = [(self, myposition, mywidth)]
+        while stack:
+            (node, position, width) = stack.pop()
+            if not node.children:
+                yield position
+                continue
+            newwidth = width/2
+            offsets = [[0,0], [0,newwidth], [newwidth,newwidth], [newwidth,0]]
+            for i in range(3, -1, -1):
+                offset = offsets[node.symmetry.actindex(i)]
+                stack.append((node.children[i], [position[0] + offset[0], position[1] + offset[1]], newwidth))
 
 class HilbertTreeMaxed(HilbertTree):
     '''
@@ -263,9 +364,20 @@ class HilbertTreeMaxed(HilbertTree):
                 3. Height of sub-rectangle (Float)
             into Int. The function should give the max level of Hilbert pseudo-curve to 
             associate with a sub-rectangle at position (x,y).
+    self.boundfunc : function
+        Optional function with parameters:
+                1. Level of the sub-rectangle (Int),
+                2. positions (x,y) (Array-like with two members),
+                3. Width of sub-rectangle (Float), 
+                4. Height of sub-rectangle (Float)
+            into True, False, or None, e.g. LevelFilter.boundfunc. It should cheaply decide whether the
+            sub-rectangle is sub-divided, or return None if that can't be decided without calling self.maxfunc.
+            Is None if self.maxfunc should always be used.
+    self.numleaves : Int
+        The number of leaf nodes in the sub-tree rooted at this node. Is updated by generatechildren.
     '''
 
-    def __init__(self, symmetry, level, position, width, height, maxfunc):
+    def __init__(self, symmetry, level, position, width, height, maxfunc, boundfunc = None):
         ''' 
         Initializer that calls parent initializer for HilbertTree
         
@@ -288,20 +400,29 @@ class HilbertTreeMaxed(HilbertTree):
             positions (x,y) (represented as array-likes with two elements) into Int. The position
             of a sub-rectangle is used to determine whether to sub-divide further based on the output
             of this function.
+        boundfunc : function
+            Optional function to decide whether to sub-divide without calling maxfunc, e.g. LevelFilter.boundfunc.
+            Returns None when maxfunc is needed. Use None to always call maxfunc.
         ''' 
         super().__init__(symmetry, level)
         self.position = position
         self.width = width
         self.height = height
         self.maxfunc = maxfunc
+        self.boundfunc = boundfunc
+        self.numleaves = 1
 
-    def generatechildren(self, numlevels):
+    def generatechildren(self, numlevels, maxsteps = None):
         '''
         Generates the children nodes of this sub-rectangle . This over-rides the generatechildren of the 
         parent class HilbertTree. Now we use self.maxfunc to decide if we have reached a high enough
         level of pseudo-curve using self.position. We also put a global maximum on the levels using 
         the parameter numlevels. If we have not reached the max level for this sub-rectangle , then 
         we sub-divide and find the children.
+
+        Like HilbertTree.generatechildren, this uses an explicit stack, so it can be paused after maxsteps
+        nodes and resumed by calling it again. The leaf counts self.numleaves are updated as sub-trees
+        are finished.
         
         Parameters
         ----------
@@ -309,12 +430,130 @@ class HilbertTreeMaxed(HilbertTree):
             Implicit reference to self.
         numlevels : Int
             The global maximum number of levels to make the tree. 
+        maxsteps : Int
+            The maximum number of nodes to visit before pausing. If None, then never pause.
+
+        Returns
+        -------
+        Bool
+            True if the tree is finished, or False if the traversal was paused.
         '''
-        if self.level > numlevels or self.level > self.maxfunc(self.position, self.width, self.height):
-            return
-        elif self.children:
+        (stack, parents) = self.buildstack if self.buildstack is not None else ([self], [])
+        self.buildstack = None
+        steps = 0
+        while stack:
+            if steps == maxsteps:
+                self.buildstack = (stack, parents)
+                return False
+            node = stack.pop()
+            steps += 1
+            if node.children or not node.subdivides(numlevels):
+                continue
+            node.makechildren()
+            parents.append(node)
+            children = node.children
+            stack.append(children[3])
+            stack.append(children[2])
+            stack.append(children[1])
+            stack.append(children[0])
+
+        # Every parent is visited before its children, so in reverse order the children are counted first.
+        for node in reversed(parents):
+            children = node.children
+            node.numleaves = children[0].numleaves + children[1].numleaves + children[2].numleaves \
+                             + children[3].numleaves
+        return True
+
+    def generatechildrenthreaded(self, numlevels, nthreads = 4, executor = None):
+        '''
+        Version of generatechildren that evaluates the filter for many nodes at once using a pool of threads.
+        The tree is built one level at a time. The nodes of the current frontier don't depend on each other,
+        so the frontier is split into nthreads contiguous parts that are filtered in parallel. All threads
+        share the same level data, so nothing is copied and no processes are started.
+
+        The resulting tree is the same as from generatechildren. The threads only run at the same time while
+        the filter is inside a numpy reduction, which releases the GIL, e.g. the numpy engines of UseMax,
+        UseAverage and UseMajority. Everything else, including setting up each window and making the
+        children, holds the GIL. So this is only faster than generatechildren on a machine with several
+        cores when most of the time is spent reducing large windows, i.e. large images with few levels.
+        With a single core, or with many small windows near the leaves, it is slower because of the
+        extra overhead of the pool.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        numlevels : Int
+            The global maximum number of levels to make the tree.
+        nthreads : Int
+            The number of threads to use if executor is None, and the number of parts to split each
+            frontier into.
+        executor : concurrent.futures.Executor
+            The pool of threads to use. If None, then a concurrent.futures.ThreadPoolExecutor is created
+            for the build.
+        '''
+        if executor is None:
+            with concurrent.futures.ThreadPoolExecutor(nthreads) as newexecutor:
+                self.generatechildrenthreaded(numlevels, nthreads, newexecutor)
             return
 
+        def decide(nodes):
+            return [node.subdivides(numlevels) for node in nodes]
+
+        parents = []
+        frontier = [self] if not self.children else []
+        while frontier:
+            partsize = -(-len(frontier) // nthreads)
+            parts = [frontier[i : i + partsize] for i in range(0, len(frontier), partsize)]
+            newfrontier = []
+            for (part, decisions) in zip(parts, executor.map(decide, parts)):
+                for (node, decision) in zip(part, decisions):
+                    if decision:
+                        node.makechildren()
+                        parents.append(node)
+                        newfrontier.extend(node.children)
+            frontier = newfrontier
+
+        for node in reversed(parents):
+            node.numleaves = sum([node.children[i].numleaves for i in range(4)])
+
+    def subdivides(self, numlevels):
+        '''
+        Decide whether this sub-rectangle should be sub-divided, i.e. whether its level is at most the
+        global maximum numlevels and at most the level given by self.maxfunc. If there is a self.boundfunc,
+        then it is tried first and self.maxfunc is only called when it can't decide.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        numlevels : Int
+            The global maximum number of levels to make the tree.
+
+        Returns
+        -------
+        Bool
+            Whether this node should have children.
+        '''
+        if self.level > numlevels:
+            return False
+        if self.boundfunc is not None:
+            decision = self.boundfunc(self.level, self.position, self.width, self.height)
+            if decision is not None:
+                return decision
+        return self.level <= self.maxfunc(self.position, self.width, self.height)
+
+    def makechildren(self):
+        '''
+        Create the four children of this node without recursing any further. The children are the 
+        sub-rectangles from dividing this sub-rectangle into an even 2x2 grid, ordered along the curve
+        and with orientations inherited from the orientation of this node.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        '''
         newwidth = self.width/2.0
         newheight = self.height/2.0
         offsets = [[0,0], [0,newheight], [newwidth,newheight], [newwidth,0]]
@@ -325,19 +564,16 @@ class HilbertTreeMaxed(HilbertTree):
                 newpositions[i][j] += offsets[newi][j]
 
         newlevel = self.level + 1
-        newsymmetries = [self.symmetry for i in range(4)]
-        newsymmetries[0] = self.symmetry.times(SquareSymmetry(3,1))
-        newsymmetries[3] = self.symmetry.times(SquareSymmetry(1,1))
-        for i in range(4):
-            self.children.append(HilbertTreeMaxed(newsymmetries[i], newlevel, newpositions[i], newwidth, newheight, self.maxfunc))
-        
+        newsymmetries = self.symmetry.childsymmetries()
         for i in range(4):
-            self.children[i].generatechildren(numlevels)
-        
+            self.children.append(HilbertTreeMaxed(newsymmetries[i], newlevel, newpositions[i], newwidth, newheight, self.maxfunc,
+                                                  self.boundfunc))
+
     def generatepositions(self, currentlist):
         '''
         Add the leaf sub-nodes of this node to a current list of positions. The order that they are added is the
-        order they occur in the curve representing the image. This is accomplished using a depth first traversal. 
+        order they occur in the curve representing the image. This is accomplished using a depth first traversal
+        with an explicit stack of iterators over the children of each node on the current path.
         
         Parameters
         ----------
@@ -346,480 +582,3867 @@ class HilbertTreeMaxed(HilbertTree):
         currentlist : Array-like
             The list of positions to add the leaf positions to.
         '''
-        if (not self.children):
-            currentlist.append(self.position)
-            return
-
-        for i in range(4):
-            self.children[i].generatepositions(currentlist)
-
-
-class ImageProcessing:
-    '''
-    Namespace with functions to handle preprocessing of black and white image (pixel values are integers 
-    in the range 0 to 255). Use the member function bwtolevels to turn pixel colors into level numbers. 
-    The transformation between the two isn't linear.
-    '''
+        append = currentlist.append
+        stack = [iter([self])]
+        while stack:
+            for node in stack[-1]:
+                if node.children:
+                    stack.append(iter(node.children))
+                    break
+                append(node.position)
+            else:
+                stack.pop()
 
-    def invertcolor(ba):
+    def generatepositionarray(self, out = None, chunksize = 4096):
         '''
-        Takes array-like holding pixel color and pixel alpha, and then turns it into inverted color 
-        represented as an Int.
-        
+        Fill a preallocated array with the positions of the leaf sub-nodes of this node in curve order. The size
+        of the array is known from self.numleaves, so no list with one entry per leaf is ever made; the positions
+        are copied in chunks of chunksize leaves. The x and y coordinates are available without copying as
+        the column views positions[:, 0] and positions[:, 1].
+
         Parameters
         ----------
-        ba : Array-like
-            Should have two members. ba[0] is the color of the pixel. ba[1] is the alpha of the pixel. 
-        
+        self : self
+            Implicit reference to self.
+        out : 2D numpy array
+            The array to fill. Should have shape (self.numleaves, 2). If None, then a new float32 array
+            is made.
+        chunksize : Int
+            The number of positions to gather before copying them into the array.
+
         Returns
         -------
-        Int 
-            The inverted color of the pixel. 
+        2D numpy array
+            Has shape (self.numleaves, 2). Each row is the (x,y) position of a leaf.
         '''
-        if ba[1] == 0:
-            return 0 
-        else:
-            return 255 - ba[0]
-    
-    def bwtolevels(bw, minlevel, maxlevel):
+        if out is None:
+            out = np.empty((self.numleaves, 2), dtype = np.float32)
+        elif out.shape != (self.numleaves, 2):
+            raise ValueError('out should have shape ' + str((self.numleaves, 2)))
+
+        start = 0
+        chunk = []
+        for position in self.iteratepositions():
+            chunk.append(position)
+            if len(chunk) == chunksize:
+                out[start : start + chunksize] = chunk
+                start += chunksize
+                chunk = []
+        if start + len(chunk) != self.numleaves:
+            raise ValueError('self.numleaves is out of date; use generatechildren to build the tree')
+        if chunk:
+            out[start:] = chunk
+        return out
+
+    def generatesequence(self, chunksize = 65536, rambudget = 64 * 2**20, directory = None):
         '''
-        Convert black and white color (Integer 0 to 255) into level numbers. Does conversion in-place.
+        Put the positions of the leaf sub-nodes of this node into a LeafSequence in curve order. Chunks of the
+        sequence that don't fit into the RAM budget are spilled to a memory-mapped file, so trees with more
+        leaves than fit into memory can still be drawn.
 
         Parameters
         ----------
-        bw : 2D Array-like
-            2D Array of holding Integers (0 to 255) representing black and white colors.
-        minlevel : Int
-            The minimum Hilbert pseudo-curve level to assign to any color.
-        maxlevel : Int
-            The maximum Hilbert pseudo-curve level to assign to any color.
-        '''
-        base = 2.5
-        maxbw = 0
-        for i in range(len(bw)):
-            testmax = max(bw[i])
-            if testmax > maxbw:
-                maxbw = testmax
-    
-        if maxbw == 0:
-            maxbw = 1.0
-    
-        for i in range(len(bw)):
-            for j in range(len(bw[0])):
-                level = bw[i][j]/maxbw
-                level *= base**maxlevel - base**minlevel 
-                level += base**minlevel 
-                level = np.log(level)/np.log(base)
-                bw[i][j] = level
-
-class LevelFilter:
-    '''
-    Template class that provides functionality for contructing functions for determining the max
-    number of levels of sub-rectangle to assign to any given position. Note, this parent class doesn't
-    really have any actual funtionality for constructing such functions. It just provides functions that
-    will be necessary for constructing them from a 2D array of pixel levels.
+        self : self
+            Implicit reference to self.
+        chunksize : Int
+            The number of positions in each chunk.
+        rambudget : Int
+            The maximum number of bytes of chunks to keep in memory.
+        directory : String
+            The directory for the spill file. If None, then the default temporary directory is used.
 
-    Members
-    -------
-    levels : 2D Array-like
-        Pixel levels coming from an image. Note this isn't the pixel colors. They should first be 
-        pre-processed in some way, e.g. use the class ImageProcessing. 
-    imwidth : Int
-        The width of the levels data coming from the image.
-    imheight : Int
-        The height of the levels data coming from the image. 
-    x0 : Int
-        The x position of the first corner of the image data to associate with a sub-rectangle .
-    x1 : Int
-        The x position of the second corner of the image data to associate with a sub-rectangle .
-    y0 : Int
-        The y position of the first corner of the image data to associate with a sub-rectangle .
-    y1 : Int
-        The y position of the second corner of the image data to associate with a sub-rectangle . 
-    '''
+        Returns
+        -------
+        LeafSequence
+            The positions of the leaves.
+        '''
+        sequence = LeafSequence(chunksize, rambudget, directory)
+        sequence.extend(self.iteratepositions())
+        return sequence
 
-    def __init__(self, levels):
+    def iteratepositions(self):
         '''
-        Initializer. Use the levels data to find self.imwidth and self.imheight. Initialize 
-        self.x0, self.y0 to the origin and self.x1, self.y1 to the opposite corner of image data.
+        Generator version of generatepositions. Yields the positions of the leaf sub-nodes of this node in the
+        order they occur in the curve, so that consumers can stream the curve without building the whole list,
+        or pause and resume the traversal.
 
         Parameters
         ----------
         self : self
             Implicit reference to self.
-        levels : 2D Array-like
-            2D array-like holding levels data of each pixel in an image. Note, the levels data
-            is not the same thing as color data. The pixel colors should first be preprocessed, 
-            e.g. using class ImageProcessing.
-        '''
-        self.levels = levels
-        self.imwidth = len(levels[0])
-        self.imheight = len(levels)
-        self.x0 = 0
-        self.x1 = self.imwidth
-        self.y0 = 0
-        self.y1 = self.imheight
 
-    def filterfunc(pos, width, height):
+        Returns
+        -------
+        Generator of Array-like
+            The positions of the leaves in curve order.
         '''
-        The function giving the maximum level of pseudo-curve. The default implementation for this
-        parent class just returns level 0, so don't sub-divide at all.
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.children:
+                stack.extend(reversed(node.children))
+            else:
+                yield node.position
 
-        This function should be over-ridden by classes that inherit from the class LevelFilter. 
+    def curveinrect(self, x0, y0, x1, y1):
+        '''
+        Find the part of the curve that lies inside a rectangular viewport without traversing the whole tree.
+        Only the nodes whose sub-rectangles intersect the viewport are visited, so the cost is proportional
+        to the visible part of the curve. The tree should already be built using generatechildren.
 
         Parameters
         ----------
-        pos : Array-like
-            Should have two members holding the x and y position.
-        width : Float
-            The width of the sub-rectangle.
-        height : Float
-            The height of the sub-rectangle.
+        self : self
+            Implicit reference to self.
+        x0 : Float
+            The x position of the first corner of the viewport.
+        y0 : Float
+            The y position of the first corner of the viewport.
+        x1 : Float
+            The x position of the opposite corner of the viewport.
+        y1 : Float
+            The y position of the opposite corner of the viewport.
 
         Returns
         -------
-        Int
-            Maximum level of pseudo-curve to assign to this sub-rectangle. The default implementation always
-            returns 0. 
+        List of List of Int
+            Each member is a pair [start, end] giving a contiguous half-open range of leaf indices (in
+            the order of generatepositions) that are inside the viewport.
+        List of Array-like
+            The positions of the leaves inside the viewport in the order they occur in the curve.
         '''
-        return 0
+        rect = [min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)]
+        ranges = []
+        positions = []
+        self.collectinrect(rect, 0, ranges, positions)
+        return ranges, positions
 
-    def setupxy(self, pos, width, height):
+    def collectinrect(self, rect, startindex, ranges, positions):
         '''
-        Finds the indices in the level data that occur within the rectangle of a given width and height with
-        a given corner position. Note that this rectangle data can be composed of floating point values,
-        but the the indices we find need to be valid integers representing indices in our 2D array of
-        pixel levels. This range of pixel data should be used by filterfunc to find max levels based
-        on image data.
-
-        The corner indices of the selected pixel data is stored in self.x0, self.x1, self.y0, and self.y1.
+        Recursive helper for curveinrect. If this node's sub-rectangle intersects the viewport, then add
+        its leaves to the ranges and positions; else, do nothing.
 
         Parameters
         ----------
         self : self
             Implicit reference to self.
-        pos : Array-like
-            Has two members representing the x and y positions of the corner of the rectangle. Positons
-            can be floating point values.
-        width : Float
-            The width of the rectangle.
-        height : Float
-            The height of the rectangle.
+        rect : Array-like
+            Has four members [xmin, ymin, xmax, ymax] representing the viewport.
+        startindex : Int
+            The index of the first leaf of this node in the order of the whole curve.
+        ranges : List of List of Int
+            The current list of half-open leaf index ranges. Adjacent ranges are merged.
+        positions : List of Array-like
+            The current list of leaf positions inside the viewport.
         '''
-        self.x0 = int(pos[0])
-        self.x0 = max(self.x0, 0)
-        self.x1 = int(self.x0 + width)
-        self.x1 = min(self.x1, self.imwidth)
+        if self.position[0] > rect[2] or self.position[0] + self.width <= rect[0]:
+            return
+        if self.position[1] > rect[3] or self.position[1] + self.height <= rect[1]:
+            return
 
-        self.y0 = int(pos[1])
-        self.y0 = max(self.y0, 0)
-        self.y1 = int(self.y0 + height)
-        self.y1 = min(self.y1, self.imheight)
+        if not self.children:
+            if ranges and ranges[-1][1] == startindex:
+                ranges[-1][1] = startindex + 1
+            else:
+                ranges.append([startindex, startindex + 1])
+            positions.append(self.position)
+            return
 
-class UseMax(LevelFilter):
+        for i in range(4):
+            self.children[i].collectinrect(rect, startindex, ranges, positions)
+            startindex += self.children[i].numleaves
+
+
+class HilbertTreeCells(HilbertTreeMaxed):
     '''
-    Class for setting the max level Hilbert pseudo-curve function of a sub-rectangle is given by finding
-    the maximum level value inside the pixel values contained within the sub-rectangle.
+    Version of HilbertTreeMaxed using exact integer geometry. Instead of storing a floating point position,
+    width, and height that are halved at every level, each node stores the index of its cell in the grid
+    that evenly divides the root rectangle into 2**depth by 2**depth cells. The pixel window of a cell is found
+    from the cell index using integer multiplication and shifts, see LevelFilter.setupcell, so builds don't
+    depend on floating point rounding and the cells at each depth exactly partition the pixels of the image.
+    For depths up to 31 the cell indices fit into 32-bit integers, so the leaves can be packed compactly into
+    an array using packcells.
 
-    The Parent class is LevelFilter, and the class UseMax contains no extra member variables.
+    The floating point position, width, and height are still available as properties computed from the
+    cell, so the methods inherited from HilbertTreeMaxed such as generatepositions and curveinrect work
+    the same way. The root rectangle always has its corner at (0,0).
+
+    Members
+    -------
+    self.symmetry : SquareSymmetry
+        Represents the orientation of this sub-rectangle relative to the standard orientation.
+    self.level : Int
+        Represents the level of the Hilbert pseudo-curve that this node is a part of.
+    self.cell : List of Int
+        Has two members. The x and y index of the cell of this node.
+    self.depth : Int
+        The number of times the root rectangle has been sub-divided to get this node.
+    self.rootwidth : Int
+        The width of the root rectangle.
+    self.rootheight : Int
+        The height of the root rectangle.
+    self.cellfunc : function
+        A function with parameters:
+                1. cell index (Array-like with two Int members),
+                2. depth (Int)
+            into Int, e.g. LevelFilter.cellfunc. The function should give the max level of Hilbert
+            pseudo-curve to associate with the cell.
+    self.boundfunc : function
+        Optional function with parameters:
+                1. Level of the cell (Int),
+                2. cell index (Array-like with two Int members),
+                3. depth (Int)
+            into True, False, or None, e.g. LevelFilter.cellboundfunc. It should cheaply decide whether the
+            cell is sub-divided, or return None if that can't be decided without calling self.cellfunc.
+            Is None if self.cellfunc should always be used.
+    self.numleaves : Int
+        The number of leaf nodes in the sub-tree rooted at this node. Is updated by generatechildren.
     '''
 
-    def filterfunc(self, pos, width, height):
+    def __init__(self, symmetry, level, cell, depth, rootwidth, rootheight, cellfunc, boundfunc = None):
         '''
-        The max level Hilbert pseudo-curve function for the class UseMax. The max level for the 
-        sub-rectangle of certain position, width, and height is given by the maximum pixel level for
-        the portion of the pixels contained within the sub-rectangle.
+        Initializer.
 
         Parameters
         ----------
         self : self
             Implicit reference to self.
-        pos : Array-like
-            Should contain two members of floating point values giving the x and y position of the
-            sub-rectangle.
-        width : Float
-            The width of the sub-rectangle.
-        height : Float
-            The height of the sub-rectangle.
-
+        symmetry : SquareSymmetry
+            Reperesents the orientation of this sub-rectangle relative to the standard orientation.
+        level : Int
+            The level of Hilbert pseudo-curve to associate with this sub-rectangle node.
+        cell : List of Int
+            Has two members. The x and y index of the cell of this node. Use [0,0] for the root.
+        depth : Int
+            The number of times the root rectangle has been sub-divided to get this node. Use 0 for the root.
+        rootwidth : Int
+            The width of the root rectangle.
+        rootheight : Int
+            The height of the root rectangle.
+        cellfunc : function
+            The function to determine how far to sub-divide a given cell, e.g. LevelFilter.cellfunc.
+        boundfunc : function
+            Optional function to decide whether to sub-divide without calling cellfunc, e.g.
+            LevelFilter.cellboundfunc. Use None to always call cellfunc.
+        '''
+        HilbertTree.__init__(self, symmetry, level)
+        self.cell = cell
+        self.depth = depth
+        self.rootwidth = rootwidth
+        self.rootheight = rootheight
+        self.cellfunc = cellfunc
+        self.boundfunc = boundfunc
+        self.numleaves = 1
+
+    @property
+    def position(self):
+        '''
+        The (x,y) position of the corner of this cell as a list of two Floats.
+        '''
+        return [self.cell[0] * self.rootwidth / 2**self.depth, self.cell[1] * self.rootheight / 2**self.depth]
+
+    @property
+    def width(self):
+        '''
+        The width of this cell as a Float.
+        '''
+        return self.rootwidth / 2**self.depth
+
+    @property
+    def height(self):
+        '''
+        The height of this cell as a Float.
+        '''
+        return self.rootheight / 2**self.depth
+
+    def subdivides(self, numlevels):
+        '''
+        Decide whether this cell should be sub-divided, i.e. whether its level is at most the global
+        maximum numlevels and at most the level given by self.cellfunc. If there is a self.boundfunc,
+        then it is tried first and self.cellfunc is only called when it can't decide.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        numlevels : Int
+            The global maximum number of levels to make the tree.
+
+        Returns
+        -------
+        Bool
+            Whether this node should have children.
+        '''
+        if self.level > numlevels:
+            return False
+        if self.boundfunc is not None:
+            decision = self.boundfunc(self.level, self.cell, self.depth)
+            if decision is not None:
+                return decision
+        return self.level <= self.cellfunc(self.cell, self.depth)
+
+    def makechildren(self):
+        '''
+        Create the four children of this node without recursing any further. The cell indices of the
+        children are found by doubling the cell index of this node and adding offsets of 0 or 1.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        '''
+        offsets = [[0,0], [0,1], [1,1], [1,0]]
+        newlevel = self.level + 1
+        newdepth = self.depth + 1
+        newsymmetries = self.symmetry.childsymmetries()
+        for i in range(4):
+            newi = self.symmetry.actindex(i)
+            newcell = [2 * self.cell[0] + offsets[newi][0], 2 * self.cell[1] + offsets[newi][1]]
+            self.children.append(HilbertTreeCells(newsymmetries[i], newlevel, newcell, newdepth,
+                                                  self.rootwidth, self.rootheight, self.cellfunc,
+                                                  self.boundfunc))
+
+    def packcells(self):
+        '''
+        Pack the leaves of this node into an array in the order they occur in the curve.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+
+        Returns
+        -------
+        2D numpy array of int32
+            Has shape (self.numleaves, 3). Each row is the depth, x cell index, and y cell index of a leaf.
+        '''
+        packed = np.empty((self.numleaves, 3), dtype = np.int32)
+        stack = [self]
+        index = 0
+        while stack:
+            node = stack.pop()
+            if node.children:
+                stack.extend(reversed(node.children))
+            else:
+                packed[index] = [node.depth, node.cell[0], node.cell[1]]
+                index += 1
+        return packed
+
+class LeafSequence:
+    '''
+    Class for holding a long sequence of leaf positions without needing all of them in memory. The positions
+    are stored as float32 in fixed size chunks. When a chunk is full, it is kept in memory if it fits into
+    the RAM budget; else, it is appended to a spill file. Spilled chunks are read through one read-only
+    memory map of the whole spill file, which is remapped when a read needs a chunk past its end, so
+    only one file descriptor is held however many chunks are spilled. The sequence supports len(), iteration, and indexing with integers and slices, so 
+    renderers can read it a part at a time.
+
+    Use close, or use the sequence as a context manager, to remove the spill file. If the sequence is
+    dropped without being closed, the spill file is removed when it is garbage collected or at exit.
+
+    Members
+    -------
+    self.chunksize : Int
+        The number of positions in each chunk.
+    self.rambudget : Int
+        The maximum number of bytes of chunks to keep in memory.
+    self.directory : String
+        The directory for the spill file, or None for the default temporary directory.
+    self.chunks : List of 2D numpy array or Int
+        The full chunks in order. A chunk kept in memory has shape (self.chunksize, 2); a spilled chunk is
+        the Int index of the chunk in the spill file.
+    self.current : 2D numpy array
+        The chunk being filled.
+    self.ncurrent : Int
+        The number of positions in self.current.
+    self.ramused : Int
+        The number of bytes of full chunks kept in memory.
+    self.spillname : String
+        The name of the spill file, or None if nothing has been spilled.
+    self.nspilled : Int
+        The number of chunks in the spill file.
+    self.spillmap : numpy memmap
+        Read-only memory map of the start of the spill file, with shape (n, 2). Is None until a spilled
+        chunk is read.
+    self.remover : weakref.finalize
+        Removes the spill file when called, or when the sequence is garbage collected. Is None if there is
+        no spill file.
+    '''
+
+    def __init__(self, chunksize = 65536, rambudget = 64 * 2**20, directory = None):
+        '''
+        Initializer. Starts empty.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        chunksize : Int
+            The number of positions in each chunk.
+        rambudget : Int
+            The maximum number of bytes of chunks to keep in memory. The chunk being filled counts
+            towards the budget.
+        directory : String
+            The directory for the spill file. If None, then the default temporary directory is used.
+        '''
+        self.chunksize = chunksize
+        self.rambudget = rambudget
+        self.directory = directory
+        self.chunks = []
+        self.current = np.empty((chunksize, 2), dtype = np.float32)
+        self.ncurrent = 0
+        self.ramused = 0
+        self.spillname = None
+        self.nspilled = 0
+        self.spillmap = None
+        self.remover = None
+
+    def __len__(self):
+        '''
+        The number of positions in the sequence.
+        '''
+        return len(self.chunks) * self.chunksize + self.ncurrent
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, excvalue, traceback):
+        self.close()
+
+    def append(self, position):
+        '''
+        Add one position to the end of the sequence.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        position : Array-like
+            Has two members, the x and y position.
+        '''
+        self.extend([position])
+
+    def extend(self, positions):
+        '''
+        Add positions to the end of the sequence. The positions are gathered into a list until the current
+        chunk is full, and then copied into it at once.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        positions : Iterable of Array-like
+            The positions to add in order.
+        '''
+        gathered = []
+        space = self.chunksize - self.ncurrent
+        for position in positions:
+            gathered.append(position)
+            if len(gathered) == space:
+                self.current[self.ncurrent:] = gathered
+                self.ncurrent = self.chunksize
+                self.finishchunk()
+                gathered = []
+                space = self.chunksize
+        if gathered:
+            self.current[self.ncurrent : self.ncurrent + len(gathered)] = gathered
+            self.ncurrent += len(gathered)
+
+    def finishchunk(self):
+        '''
+        Move the full current chunk into self.chunks, spilling it to the spill file if keeping it in memory
+        would go over the RAM budget, and start a new current chunk.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        '''
+        chunkbytes = self.current.nbytes
+        if self.ramused + 2 * chunkbytes <= self.rambudget:
+            self.chunks.append(self.current)
+            self.ramused += chunkbytes
+        else:
+            if self.spillname is None:
+                (handle, self.spillname) = tempfile.mkstemp(suffix = '.leaves', dir = self.directory)
+                os.close(handle)
+                self.remover = weakref.finalize(self, os.remove, self.spillname)
+            with open(self.spillname, 'ab') as spillfile:
+                spillfile.write(self.current.tobytes())
+            self.chunks.append(self.nspilled)
+            self.nspilled += 1
+        self.current = np.empty((self.chunksize, 2), dtype = np.float32)
+        self.ncurrent = 0
+
+    def getchunk(self, chunkid):
+        '''
+        Get a chunk by its position in the sequence. A spilled chunk is a view of self.spillmap, which is
+        remapped first if it doesn't reach the chunk.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        chunkid : Int
+            The position of the chunk. If it is len(self.chunks), then the current chunk is returned.
+
+        Returns
+        -------
+        2D numpy array
+            Has shape (self.chunksize, 2).
+        '''
+        if chunkid >= len(self.chunks):
+            return self.current
+        chunk = self.chunks[chunkid]
+        if not isinstance(chunk, int):
+            return chunk
+        start = chunk * self.chunksize
+        if self.spillmap is None or len(self.spillmap) < start + self.chunksize:
+            self.spillmap = np.memmap(self.spillname, dtype = np.float32, mode = 'r',
+                                      shape = (self.nspilled * self.chunksize, 2))
+        return self.spillmap[start : start + self.chunksize]
+
+    def iterchunks(self):
+        '''
+        Generator of the chunks in order, including the part of the current chunk that is filled.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+
+        Returns
+        -------
+        Generator of 2D numpy array
+            Each chunk has shape (n, 2).
+        '''
+        for chunkid in range(len(self.chunks)):
+            yield self.getchunk(chunkid)
+        if self.ncurrent > 0:
+            yield self.current[:self.ncurrent]
+
+    def __iter__(self):
+        '''
+        Iterate over the positions in order, one chunk in memory at a time.
+        '''
+        for chunk in self.iterchunks():
+            yield from chunk
+
+    def __getitem__(self, index):
+        '''
+        Get a position or a slice of positions. Only the chunks holding the positions are read.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        index : Int or slice
+            The index of a position, or a slice of indices.
+
+        Returns
+        -------
+        numpy array
+            Shape (2,) for an Int index, or shape (n, 2) for a slice.
+        '''
+        if isinstance(index, slice):
+            indices = np.arange(*index.indices(len(self)))
+            result = np.empty((len(indices), 2), dtype = np.float32)
+            chunkids = indices // self.chunksize
+            for chunkid in np.unique(chunkids):
+                chunk = self.getchunk(chunkid)
+                selected = chunkids == chunkid
+                result[selected] = chunk[indices[selected] - chunkid * self.chunksize]
+            return result
+
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('LeafSequence index out of range')
+        (chunkid, offset) = divmod(index, self.chunksize)
+        return np.array(self.getchunk(chunkid)[offset])
+
+    def close(self):
+        '''
+        Drop all of the positions and remove the spill file.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        '''
+        self.chunks = []
+        self.ncurrent = 0
+        self.ramused = 0
+        self.nspilled = 0
+        self.spillmap = None
+        if self.remover is not None:
+            self.remover()
+            self.remover = None
+            self.spillname = None
+
+class ImageProcessing:
+    '''
+    Namespace with functions to handle preprocessing of black and white image (pixel values are integers 
+    in the range 0 to 255). Use the member function bwtolevels to turn pixel colors into level numbers. 
+    The transformation between the two isn't linear.
+    '''
+
+    def invertcolor(ba):
+        '''
+        Takes array-like holding pixel color and pixel alpha, and then turns it into inverted color 
+        represented as an Int.
+        
+        Parameters
+        ----------
+        ba : Array-like
+            Should have two members. ba[0] is the color of the pixel. ba[1] is the alpha of the pixel. 
+        
+        Returns
+        -------
+        Int 
+            The inverted color of the pixel. 
+        '''
+        if ba[1] == 0:
+            return 0 
+        else:
+            return 255 - ba[0]
+    
+    def bwtolevels(bw, minlevel, maxlevel):
+        '''
+        Convert black and white color (Integer 0 to 255) into level numbers. Does conversion in-place.
+
+        Parameters
+        ----------
+        bw : 2D Array-like
+            2D Array of holding Integers (0 to 255) representing black and white colors.
+        minlevel : Int
+            The minimum Hilbert pseudo-curve level to assign to any color.
+        maxlevel : Int
+            The maximum Hilbert pseudo-curve level to assign to any color.
+        '''
+        base = 2.5
+        maxbw = 0
+        for i in range(len(bw)):
+            testmax = max(bw[i])
+            if testmax > maxbw:
+                maxbw = testmax
+    
+        if maxbw == 0:
+            maxbw = 1.0
+    
+        for i in range(len(bw)):
+            for j in range(len(bw[0])):
+                level = bw[i][j]/maxbw
+                level *= base**maxlevel - base**minlevel 
+                level += base**minlevel 
+                level = np.log(level)/np.log(base)
+                bw[i][j] = level
+
+class LevelFilter:
+    '''
+    Template class that provides functionality for contructing functions for determining the max
+    number of levels of sub-rectangle to assign to any given position. Note, this parent class doesn't
+    really have any actual funtionality for constructing such functions. It just provides functions that
+    will be necessary for constructing them from a 2D array of pixel levels.
+
+    Members
+    -------
+    levels : 2D Array-like
+        Pixel levels coming from an image. Note this isn't the pixel colors. They should first be 
+        pre-processed in some way, e.g. use the class ImageProcessing. 
+    imwidth : Int
+        The width of the levels data coming from the image.
+    imheight : Int
+        The height of the levels data coming from the image. 
+    x0 : Int
+        The x position of the first corner of the image data to associate with a sub-rectangle .
+    x1 : Int
+        The x position of the second corner of the image data to associate with a sub-rectangle .
+    y0 : Int
+        The y position of the first corner of the image data to associate with a sub-rectangle .
+    y1 : Int
+        The y position of the second corner of the image data to associate with a sub-rectangle . 
+    blocksize : Int
+        The width and height in pixels of the blocks used by makebounds. Is None until makebounds is called.
+    maxtablebytes : Int
+        The largest number of bytes to use for the precomputed tables of the engines of a FilterRegistry.
+        Engines whose tables would be larger are skipped.
+    blockmin : 2D numpy array
+        The minimum pixel level inside each block. Is None until makebounds is called.
+    blockmax : 2D numpy array
+        The maximum pixel level inside each block. Is None until makebounds is called.
+    nbounded : Int
+        The number of times boundfunc or cellboundfunc could decide a sub-rectangle using the block bounds.
+    nunbounded : Int
+        The number of times boundfunc or cellboundfunc couldn't decide, so the full filter was needed.
+    levelarray : 2D numpy array
+        The pixel levels as a numpy array of floats, used by the numpy engines. Is the same as levels if
+        levels is already a numpy array, else it is None until makelevelarray is called.
+    engine : String
+        The name of the engine set with useengine, e.g. by FilterRegistry.select. Is None if windowlevel
+        hasn't been replaced.
+    nsamples : Int
+        The number of pixels to sample when estimating a window, see usesampling. Is 0 if sampling is off.
+    margin : Float
+        The number of standard errors an estimate needs to be away from a decision threshold to be trusted.
+    seed : Int
+        The seed of the random samples.
+    minsampledpixels : Int
+        Only windows with at least this many pixels are sampled.
+    nsampled : Int
+        The number of windows whose decision was estimated from samples.
+    nescalated : Int
+        The number of sampled windows whose estimate was too close to a threshold, so the exact filter
+        was needed.
+    '''
+
+    def __init__(self, levels):
+        '''
+        Initializer. Use the levels data to find self.imwidth and self.imheight. Initialize 
+        self.x0, self.y0 to the origin and self.x1, self.y1 to the opposite corner of image data.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        levels : 2D Array-like
+            2D array-like holding levels data of each pixel in an image. Note, the levels data
+            is not the same thing as color data. The pixel colors should first be preprocessed, 
+            e.g. using class ImageProcessing.
+        '''
+        self.levels = levels
+        self.imwidth = len(levels[0])
+        self.imheight = len(levels)
+        self.x0 = 0
+        self.x1 = self.imwidth
+        self.y0 = 0
+        self.y1 = self.imheight
+        self.blocksize = None
+        self.maxtablebytes = 64 * 2**20
+        self.blockmin = None
+        self.blockmax = None
+        self.nbounded = 0
+        self.nunbounded = 0
+        self.levelarray = levels if isinstance(levels, np.ndarray) else None
+        self.engine = None
+        self.nsamples = 0
+        self.margin = 3.0
+        self.seed = 0
+        self.minsampledpixels = 0
+        self.nsampled = 0
+        self.nescalated = 0
+
+    def filterfunc(pos, width, height):
+        '''
+        The function giving the maximum level of pseudo-curve. The default implementation for this
+        parent class just returns level 0, so don't sub-divide at all.
+
+        This function should be over-ridden by classes that inherit from the class LevelFilter. 
+
+        Parameters
+        ----------
+        pos : Array-like
+            Should have two members holding the x and y position.
+        width : Float
+            The width of the sub-rectangle.
+        height : Float
+            The height of the sub-rectangle.
+
+        Returns
+        -------
+        Int
+            Maximum level of pseudo-curve to assign to this sub-rectangle. The default implementation always
+            returns 0. 
+        '''
+        return 0
+
+    def setupxy(self, pos, width, height):
+        '''
+        Finds the indices in the level data that occur within the rectangle of a given width and height with
+        a given corner position. Note that this rectangle data can be composed of floating point values,
+        but the the indices we find need to be valid integers representing indices in our 2D array of
+        pixel levels. This range of pixel data should be used by filterfunc to find max levels based
+        on image data.
+
+        The corner indices of the selected pixel data is stored in self.x0, self.x1, self.y0, and self.y1.
+        They are also returned, and filters should use the returned values so that they can be safely
+        called from several threads at once.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        pos : Array-like
+            Has two members representing the x and y positions of the corner of the rectangle. Positons
+            can be floating point values.
+        width : Float
+            The width of the rectangle.
+        height : Float
+            The height of the rectangle.
+
+        Returns
+        -------
+        Tuple of Int
+            The indices (self.x0, self.x1, self.y0, self.y1).
+        '''
+        x0 = int(pos[0])
+        x0 = max(x0, 0)
+        x1 = int(x0 + width)
+        x1 = min(x1, self.imwidth)
+
+        y0 = int(pos[1])
+        y0 = max(y0, 0)
+        y1 = int(y0 + height)
+        y1 = min(y1, self.imheight)
+
+        self.x0, self.x1, self.y0, self.y1 = x0, x1, y0, y1
+        return x0, x1, y0, y1
+
+    def setupcell(self, cell, depth):
+        '''
+        Integer version of setupxy for sub-rectangles given by a cell index in the grid that evenly divides
+        the whole image into 2**depth by 2**depth cells. The indices are computed exactly using integer
+        multiplication and shifts, so the cells at any depth exactly partition the pixels of the image.
+
+        The corner indices of the selected pixel data is stored in self.x0, self.x1, self.y0, and self.y1.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        cell : Array-like
+            Has two Int members, the x and y index of the cell.
+        depth : Int
+            The number of times the image has been sub-divided to get the cell.
+
+        Returns
+        -------
+        Tuple of Int
+            The indices (self.x0, self.x1, self.y0, self.y1).
+        '''
+        x0 = (cell[0] * self.imwidth) >> depth
+        x1 = ((cell[0] + 1) * self.imwidth) >> depth
+        y0 = (cell[1] * self.imheight) >> depth
+        y1 = ((cell[1] + 1) * self.imheight) >> depth
+
+        self.x0, self.x1, self.y0, self.y1 = x0, x1, y0, y1
+        return x0, x1, y0, y1
+
+    def windowlevel(self, x0, x1, y0, y1):
+        '''
+        The maximum level of pseudo-curve for the pixels with indices x0 <= i < x1 and y0 <= j < y1. The
+        default implementation for this parent class just returns level 0. 
+
+        This function should be over-ridden by classes that inherit from the class LevelFilter and
+        use the pixel levels.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Int
+            Maximum level of pseudo-curve. The default implementation always returns 0.
+        '''
+        return 0
+
+    def makelevelarray(self):
+        '''
+        Make self.levelarray from self.levels if it doesn't exist yet.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        '''
+        if self.levelarray is None:
+            self.levelarray = np.asarray(self.levels, dtype = float)
+
+    def freelevelarray(self):
+        '''
+        Drop self.levelarray if it was made by makelevelarray, i.e. if it isn't self.levels itself. It is
+        kept while sampling is turned on, since samplewindow needs it.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        '''
+        if self.levelarray is not self.levels and self.nsamples == 0:
+            self.levelarray = None
+
+    def useengine(self, name, windowfunc):
+        '''
+        Replace windowlevel for this filter by another implementation of the same function, e.g. one of the
+        engines in a FilterRegistry. The engine should already be prepared.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        name : String
+            The name of the engine. Stored in self.engine.
+        windowfunc : function
+            Has the same parameters as windowlevel, including self.
+        '''
+        self.windowlevel = types.MethodType(windowfunc, self)
+        self.engine = name
+
+    def makebounds(self, blocksize = 16):
+        '''
+        Compute the minimum and maximum pixel level inside each block of a coarse grid of square blocks
+        covering the image. This is done once, and then boundfunc can use the blocks to decide many
+        sub-rectangles without looking at their pixels.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        blocksize : Int
+            The width and height in pixels of each block. Blocks at the right and bottom edges of the image
+            may be smaller.
+        '''
+        levels = np.asarray(self.levels, dtype = float)
+        nblocksy = -(-self.imheight // blocksize)
+        nblocksx = -(-self.imwidth // blocksize)
+        padwidth = ((0, nblocksy * blocksize - self.imheight), (0, nblocksx * blocksize - self.imwidth))
+        blocks = np.pad(levels, padwidth, mode = 'edge').reshape(nblocksy, blocksize, nblocksx, blocksize)
+        self.blocksize = blocksize
+        self.blockmin = blocks.min(axis = (1, 3))
+        self.blockmax = blocks.max(axis = (1, 3))
+
+    def windowbounds(self, x0, x1, y0, y1):
+        '''
+        Bounds on the pixel levels for the pixels with indices x0 <= i < x1 and y0 <= j < y1 found using the
+        blocks from makebounds. The outer bounds use all blocks touching the pixels, so they bound every
+        pixel level. The inner bounds only use the blocks completely inside the pixels.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Float
+            A lower bound on all of the pixel levels.
+        Float
+            An upper bound on all of the pixel levels.
+        Float
+            The minimum pixel level of the blocks inside the pixels. Is None if no block is inside.
+        Float
+            The maximum pixel level of the blocks inside the pixels. Is None if no block is inside.
+        '''
+        size = self.blocksize
+        (nblocksy, nblocksx) = self.blockmin.shape
+        outermin = self.blockmin[y0 // size : (y1 - 1) // size + 1, x0 // size : (x1 - 1) // size + 1].min()
+        outermax = self.blockmax[y0 // size : (y1 - 1) // size + 1, x0 // size : (x1 - 1) // size + 1].max()
+
+        bx0 = -(-x0 // size)
+        by0 = -(-y0 // size)
+        bx1 = nblocksx if x1 >= self.imwidth else x1 // size
+        by1 = nblocksy if y1 >= self.imheight else y1 // size
+        if bx1 <= bx0 or by1 <= by0:
+            return outermin, outermax, None, None
+        innermin = self.blockmin[by0:by1, bx0:bx1].min()
+        innermax = self.blockmax[by0:by1, bx0:bx1].max()
+        return outermin, outermax, innermin, innermax
+
+    def decidebounds(self, level, x0, x1, y0, y1):
+        '''
+        Use windowbounds to decide whether a sub-rectangle of a certain level should be sub-divided, i.e.
+        whether level <= windowlevel(x0, x1, y0, y1), without looking at the pixels. The default 
+        implementation for this parent class can never decide.
+
+        This function should be over-ridden by classes that inherit from the class LevelFilter and
+        override windowlevel.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        level : Int
+            The level of the sub-rectangle.
+        x0 : Int
+            The first x index of the pixels. 
+        x1 : Int
+            One past the last x index of the pixels. Should be larger than x0.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels. Should be larger than y0.
+
+        Returns
+        -------
+        Bool
+            Whether to sub-divide, or None if the bounds can't decide. The default implementation always
+            returns None.
+        '''
+        return None
+
+    def usesampling(self, nsamples = 1024, margin = 3.0, seed = 0, minsampledpixels = None):
+        '''
+        Turn on the approximate sampled mode of boundfunc and cellboundfunc. For large windows that the block
+        bounds can't decide, the window statistic is estimated from a stratified random sample of the pixels.
+        The estimate is only used if it is more than margin standard errors away from the decision
+        threshold; else, the decision is escalated to the exact filter. So decisions are exact except with a 
+        small probability controlled by margin.
+
+        The random samples only depend on the seed and the window, so builds are reproducible.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        nsamples : Int
+            The number of pixels to sample in each window. Use 0 to turn sampling off.
+        margin : Float
+            The number of standard errors an estimate needs to be away from a threshold to be trusted.
+        seed : Int
+            The seed of the random samples.
+        minsampledpixels : Int
+            Only windows with at least this many pixels are sampled. If None, then 4 * nsamples is used.
+        '''
+        self.makelevelarray()
+        self.nsamples = nsamples
+        self.margin = margin
+        self.seed = seed
+        self.minsampledpixels = minsampledpixels if minsampledpixels is not None else 4 * nsamples
+
+    def samplewindow(self, x0, x1, y0, y1):
+        '''
+        Take a stratified random sample of the pixel levels for the pixels with indices x0 <= i < x1 and
+        y0 <= j < y1. The window is divided into an even grid of about self.nsamples strata, and one random
+        pixel is taken from each stratum.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels. Should be larger than x0.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels. Should be larger than y0.
+
+        Returns
+        -------
+        1D numpy array
+            The sampled pixel levels.
+        '''
+        self.makelevelarray()
+        nstrata = max(1, int(np.sqrt(self.nsamples)))
+        generator = np.random.default_rng([self.seed, x0, x1, y0, y1])
+        strata = np.arange(nstrata)
+        offsets = generator.random((2, nstrata, nstrata))
+        xs = x0 + ((strata[np.newaxis, :] + offsets[0]) * (x1 - x0) / nstrata).astype(int)
+        ys = y0 + ((strata[:, np.newaxis] + offsets[1]) * (y1 - y0) / nstrata).astype(int)
+        return self.levelarray[np.minimum(ys, y1 - 1), np.minimum(xs, x1 - 1)].ravel()
+
+    def standarderror(self, variance, nvalues):
+        '''
+        The standard error of an estimate from a sample, used by decidesample. A variance of 1 / nvalues is
+        added, so that the error isn't 0 when all of the samples happen to agree.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        variance : Float
+            The variance of the sampled values.
+        nvalues : Int
+            The number of sampled values.
+
+        Returns
+        -------
+        Float
+            The standard error.
+        '''
+        return np.sqrt((variance + 1.0 / nvalues) / nvalues)
+
+    def decidesample(self, level, x0, x1, y0, y1):
+        '''
+        Use samplewindow to decide whether a sub-rectangle of a certain level should be sub-divided, i.e.
+        whether level <= windowlevel(x0, x1, y0, y1). The default implementation for this parent class
+        can never decide.
+
+        This function should be over-ridden by classes that inherit from the class LevelFilter and
+        support sampling.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        level : Int
+            The level of the sub-rectangle.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Bool
+            Whether to sub-divide, or None if the estimate is too close to a threshold. The default 
+            implementation always returns None.
+        '''
+        return None
+
+    def escalationrate(self):
+        '''
+        The fraction of sampled windows that had to be escalated to the exact filter.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+
+        Returns
+        -------
+        Float
+            self.nescalated / self.nsampled, or 0 if nothing was sampled.
+        '''
+        if self.nsampled == 0:
+            return 0.0
+        return self.nescalated / self.nsampled
+
+    def boundfunc(self, level, pos, width, height):
+        '''
+        Try to decide whether a sub-rectangle should be sub-divided using the blocks from makebounds. This is
+        the bound function to use with HilbertTreeMaxed, together with filterfunc as the max function.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        level : Int
+            The level of the sub-rectangle.
+        pos : Array-like
+            Has two members representing the x and y positions of the corner of the sub-rectangle.
+        width : Float
+            The width of the sub-rectangle.
+        height : Float
+            The height of the sub-rectangle.
+
+        Returns
+        -------
+        Bool
+            Whether to sub-divide, or None if filterfunc is needed to decide.
+        '''
+        x0, x1, y0, y1 = self.setupxy(pos, width, height)
+        return self.boundwindow(level, x0, x1, y0, y1)
+
+    def cellboundfunc(self, level, cell, depth):
+        '''
+        Version of boundfunc for a sub-rectangle given as a cell index, see setupcell. This is the bound
+        function to use with HilbertTreeCells, together with cellfunc.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        level : Int
+            The level of the cell.
+        cell : Array-like
+            Has two Int members, the x and y index of the cell.
+        depth : Int
+            The number of times the image has been sub-divided to get the cell.
+
+        Returns
+        -------
+        Bool
+            Whether to sub-divide, or None if cellfunc is needed to decide.
+        '''
+        x0, x1, y0, y1 = self.setupcell(cell, depth)
+        return self.boundwindow(level, x0, x1, y0, y1)
+
+    def boundwindow(self, level, x0, x1, y0, y1):
+        '''
+        Shared part of boundfunc and cellboundfunc. Empty windows are never decided. First the block bounds
+        are tried if there are any, and then sampling if it is turned on and the window is large enough.
+        Counts the results in self.nbounded and self.nunbounded, and the sampled windows in self.nsampled 
+        and self.nescalated.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        level : Int
+            The level of the sub-rectangle.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Bool
+            Whether to sub-divide, or None if the full filter is needed to decide.
+        '''
+        decision = None
+        if self.blocksize is not None and x1 > x0 and y1 > y0:
+            decision = self.decidebounds(level, x0, x1, y0, y1)
+        if decision is None and self.nsamples > 0 and x1 > x0 and y1 > y0 \
+           and (x1 - x0) * (y1 - y0) >= self.minsampledpixels:
+            self.nsampled += 1
+            decision = self.decidesample(level, x0, x1, y0, y1)
+            if decision is None:
+                self.nescalated += 1
+        if decision is None:
+            self.nunbounded += 1
+        else:
+            self.nbounded += 1
+        return decision
+
+    def cellfunc(self, cell, depth):
+        '''
+        The maximum level of pseudo-curve for a sub-rectangle given as a cell index, see setupcell. This is 
+        the max level function to use with HilbertTreeCells.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        cell : Array-like
+            Has two Int members, the x and y index of the cell.
+        depth : Int
+            The number of times the image has been sub-divided to get the cell.
+
+        Returns
+        -------
+        Int
+            Maximum level of pseudo-curve to assign to this cell.
+        '''
+        x0, x1, y0, y1 = self.setupcell(cell, depth)
+        return self.windowlevel(x0, x1, y0, y1)
+
+class UseMax(LevelFilter):
+    '''
+    Class for setting the max level Hilbert pseudo-curve function of a sub-rectangle is given by finding
+    the maximum level value inside the pixel values contained within the sub-rectangle.
+
+    The Parent class is LevelFilter, and the class UseMax contains no extra member variables.
+    '''
+
+    def filterfunc(self, pos, width, height):
+        '''
+        The max level Hilbert pseudo-curve function for the class UseMax. The max level for the 
+        sub-rectangle of certain position, width, and height is given by the maximum pixel level for
+        the portion of the pixels contained within the sub-rectangle.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        pos : Array-like
+            Should contain two members of floating point values giving the x and y position of the
+            sub-rectangle.
+        width : Float
+            The width of the sub-rectangle.
+        height : Float
+            The height of the sub-rectangle.
+
+        Returns
+        -------
+        Int
+            Maximum pixel level for all of the pixels contained within the rectangle defined by the
+            position sub-rectangle, the sub-rectangles width, and the sub-rectangles height.
+        '''
+        x0, x1, y0, y1 = self.setupxy(pos, width, height)
+        return self.windowlevel(x0, x1, y0, y1)
+
+    def windowlevel(self, x0, x1, y0, y1):
+        '''
+        The maximum pixel level for the pixels with indices x0 <= i < x1 and y0 <= j < y1. Uses windowlevelnumpy
+        if there is a self.levelarray, else windowlevelpython.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Int
+            Maximum pixel level for the pixels, but at least the floor level 0.
+        '''
+        if self.levelarray is not None:
+            return self.windowlevelnumpy(x0, x1, y0, y1)
+        return self.windowlevelpython(x0, x1, y0, y1)
+
+    def windowlevelpython(self, x0, x1, y0, y1):
+        '''
+        Version of windowlevel that loops over the pixels in pure Python. This is the reference engine.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Int
+            Maximum pixel level for the pixels, but at least the floor level 0.
+        '''
+        floorlevel = 0
+        levelsmax = 0
+        
+        for i in range(x0, x1, 1):
+            for j in range(y0, y1, 1):
+                if self.levels[j][i] > levelsmax:
+                    levelsmax = self.levels[j][i]
+        if levelsmax < floorlevel:
+            return floorlevel
+        else:
+            return levelsmax 
+
+    def windowlevelnumpy(self, x0, x1, y0, y1):
+        '''
+        Version of windowlevel using a numpy reduction over a slice of self.levelarray.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Int
+            Maximum pixel level for the pixels, but at least the floor level 0.
+        '''
+        floorlevel = 0
+        levelsmax = 0
+        window = self.levelarray[y0:y1, x0:x1]
+        if window.size > 0:
+            levelsmax = max(levelsmax, window.max())
+        return max(levelsmax, floorlevel)
+
+    def decidebounds(self, level, x0, x1, y0, y1):
+        '''
+        Decide whether to sub-divide using block bounds. If the level is above the upper bound of all
+        the pixels, then it is above the maximum, so don't sub-divide. If it is at most the maximum of
+        the blocks inside the pixels, then sub-divide.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        level : Int
+            The level of the sub-rectangle.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Bool
+            Whether to sub-divide, or None if the bounds can't decide.
+        '''
+        outermin, outermax, innermin, innermax = self.windowbounds(x0, x1, y0, y1)
+        floorlevel = 0
+        if level > max(outermax, floorlevel):
+            return False
+        if innermax is not None and level <= max(innermax, floorlevel):
+            return True
+        return None
+
+class UseAverage(LevelFilter):
+    '''
+    Class for defining the maximum Hilbert pseudo-curve level to be the average of the pixel levels 
+    for those pixels that occur within the sub-rectangle.
+    
+    Parent class is LevelFilter.
+
+    Members
+    -------
+    integral : 2D numpy array
+        The summed area table of the pixel levels, used by windowlevelintegral. Is None until makeintegral
+        is called.
+    integralerror : Float
+        A bound on the rounding error of a sum found from self.integral.
+    '''
+
+    def __init__(self, levels):
+        '''
+        Initializer.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        levels : 2D array-like
+            2D array of pixel level info. Note this is not pixel color; there should be some preprocessing
+            performed first, e.g. use class ImageProcessing. 
+        '''
+        super().__init__(levels)
+        self.integral = None
+        self.integralerror = 0.0
+
+    def filterfunc(self, pos, width, height):
+        '''
+        Function giving the maximum Hilbert pseudo-curve level for the sub-rectangle of a given position, width,
+        and height. The max level is the average of all of the pixel level data for the pixels within the
+        rectangle of the same position, width, and height. 
+    
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        pos : Array-like
+            Should have two floating points values representing the x and y position of the sub-rectangle.
+        width : Float
+            The width of the sub-rectangle.
+        height : Float
+            The height of the sub-rectangle. 
+
+        Returns
+        -------
+        Float
+            Maximum level for Hilbert pseudo-curves for given sub-rectangle; is the average of all pixel levels
+            for pixels within rectangle of same position, width, and height as the sub-rectangle.
+        '''
+        x0, x1, y0, y1 = self.setupxy(pos, width, height)
+        return self.windowlevel(x0, x1, y0, y1)
+
+    def windowlevel(self, x0, x1, y0, y1):
+        '''
+        The average pixel level for the pixels with indices x0 <= i < x1 and y0 <= j < y1. Uses windowlevelnumpy
+        if there is a self.levelarray, else windowlevelpython.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Float
+            The average of the pixel levels. Is 0 if there are no pixels.
+        '''
+        if self.levelarray is not None:
+            return self.windowlevelnumpy(x0, x1, y0, y1)
+        return self.windowlevelpython(x0, x1, y0, y1)
+
+    def windowlevelpython(self, x0, x1, y0, y1):
+        '''
+        Version of windowlevel that loops over the pixels in pure Python. This is the reference engine.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Float
+            The average of the pixel levels. Is 0 if there are no pixels.
+        '''
+        dx = 1
+        dy = 1
+        average = 0
+        nvalues = 0
+
+        for i in range(x0, x1, dx):
+            for j in range(y0, y1, dy):
+                average += self.levels[j][i]
+                nvalues += 1
+        if nvalues > 0:
+            average /= nvalues
+        else:
+            average = 0
+
+        return average 
+
+    def windowlevelnumpy(self, x0, x1, y0, y1):
+        '''
+        Version of windowlevel using a numpy reduction over a slice of self.levelarray.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Float
+            The average of the pixel levels. Is 0 if there are no pixels.
+        '''
+        window = self.levelarray[y0:y1, x0:x1]
+        if window.size > 0:
+            return window.mean()
+        return 0
+
+    def makeintegral(self):
+        '''
+        Make the summed area table self.integral, so that the sum of the pixel levels over any rectangle
+        can be found from four of its entries.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        '''
+        if self.integral is not None:
+            return
+        self.makelevelarray()
+        self.integral = np.zeros((self.imheight + 1, self.imwidth + 1))
+        self.integral[1:, 1:] = self.levelarray.cumsum(axis = 0).cumsum(axis = 1)
+        # Each entry is rounded once per addition, and a window sum combines four entries.
+        largest = np.abs(self.levelarray).sum()
+        self.integralerror = 4 * (self.imwidth + self.imheight) * np.finfo(float).eps * largest
+
+    def integralbytes(self):
+        '''
+        The number of bytes self.integral takes, so that it can be checked before calling makeintegral.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+
+        Returns
+        -------
+        Int
+            The number of bytes.
+        '''
+        return (self.imheight + 1) * (self.imwidth + 1) * 8
+
+    def freeintegral(self):
+        '''
+        Drop self.integral.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        '''
+        self.integral = None
+
+    def windowlevelintegral(self, x0, x1, y0, y1):
+        '''
+        Version of windowlevel using the summed area table from makeintegral, so the cost doesn't depend on
+        the number of pixels. The sum from the table has rounding errors, so e.g. a window where every
+        level is 6 can give 5.99999999999999. The tree compares the levels with whole numbers, so
+        averages within the rounding error of a whole number are returned as that whole number.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Float
+            The average of the pixel levels. Is 0 if there are no pixels.
+        '''
+        if x1 <= x0 or y1 <= y0:
+            return 0
+        integral = self.integral
+        total = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+        nvalues = (x1 - x0) * (y1 - y0)
+        nearest = round(total / nvalues)
+        if abs(total - nearest * nvalues) <= self.integralerror:
+            return float(nearest)
+        return total / nvalues
+
+    def decidebounds(self, level, x0, x1, y0, y1):
+        '''
+        Decide whether to sub-divide using block bounds. The average is between the lower and upper bound
+        of all of the pixels.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        level : Int
+            The level of the sub-rectangle.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Bool
+            Whether to sub-divide, or None if the bounds can't decide.
+        '''
+        outermin, outermax, innermin, innermax = self.windowbounds(x0, x1, y0, y1)
+        if level > outermax:
+            return False
+        if level <= outermin:
+            return True
+        return None
+
+    def decidesample(self, level, x0, x1, y0, y1):
+        '''
+        Decide whether to sub-divide by estimating the average from a sample of the pixels. The decision is
+        only made if the level is more than self.margin standard errors away from the estimated average.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        level : Int
+            The level of the sub-rectangle.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Bool
+            Whether to sub-divide, or None if the estimate is too close to the level.
+        '''
+        values = self.samplewindow(x0, x1, y0, y1)
+        nvalues = len(values)
+        estimate = values.mean()
+        stderror = self.standarderror(values.var(), nvalues)
+        if level > estimate + self.margin * stderror:
+            return False
+        if level <= estimate - self.margin * stderror:
+            return True
+        return None
+
+class UseMajority(LevelFilter):
+    '''
+    Class for using the majority of levels of pixels within sub-rectangle to determine the max level of Hilbert
+    pseudo-curve. Uses the pixel data that is contained in the rectangle defined by the sub-rectangle's position,
+    width, and height to find the max level. The max level is defined to be the majority level over all of this
+    subset of data.
+
+    Members
+    -------
+    levels : 2D array-like
+        2D array of pixel level information. Note this is not pixel color; there should be some preprocessing
+        performed first, e.g. use class ImageProcessing. 
+    numlevels : Int
+        The maximum number of levels. Used to construct array counting frequency of levels in pixel level info.
+    floorpercent : Float
+        The fraction of the pixels that the majority level needs to be more than. Otherwise, sub-rectangles
+        are sub-divided up to the max level.
+    minreturn : Int
+        The smallest majority level that is returned.
+    integral : 3D numpy array of int32
+        For each frequency bin, the summed area table counting the pixels in that bin, used by 
+        windowlevelintegral. Is None until makeintegral is called.
+    blockcounts : 3D numpy array
+        The summed area tables over the blocks from makebounds counting the pixels in each frequency bin.
+        Is indexed by block row, block column and then bin. Is None until makebounds is called. For blocks
+        of one pixel, it is a view of self.integral. UseMajority uses these instead of self.blockmin and
+        self.blockmax.
+    '''
+
+    def __init__(self, levels, numlevels):
+        '''
+        Initializer
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        levels : 2D array-like
+            2D array of pixel level info. Note this is not pixel color; there should be some preprocessing
+            performed first, e.g. use class ImageProcessing. 
+        numlevels : Int
+            The maximum number of levels. Used to construct array counting frequency of levels in pixel level info.
+        ''' 
+
+        super().__init__(levels)
+        self.numlevels = numlevels
+        self.floorpercent = 0.99
+        self.minreturn = 0 # numlevels-3 
+        self.integral = None
+        self.blockcounts = None
+
+    def filterfunc(self, pos, width, height):
+        '''
+        Function to determine max level Hilbert pseudo-curve for given sub-rectangle. Use the majority pixel level
+        for the pixel data contained within the sub-rectangle. There is also a filter involving meeting a minimum
+        percent of the given pixels. If none of the levels meets the minimum floor, then it returns the max
+        level, insuring the sub-rectangle will be sub-divided if it isn't at the max level. 
+        
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        pos : Array-like
+            Should be array-like containing two floating point values representing the x and y coordinate of
+            the position of the sub-rectangle.
+        width : Float
+            The width of the sub-rectangle.
+        height : Float
+            The height of the sub-rectangle.
+
+        Returns
+        -------
+        Int
+            The majority level among the pixel level data for the pixels that are inside the sub-rectangle if the
+            majority is above a certain floor percentage; else, return the max number of levels in the tree.
+        '''
+        x0, x1, y0, y1 = self.setupxy(pos, width, height)
+        return self.windowlevel(x0, x1, y0, y1)
+
+    def windowlevel(self, x0, x1, y0, y1):
+        '''
+        The majority level for the pixels with indices x0 <= i < x1 and y0 <= j < y1, if the majority is
+        above a certain floor percentage. Uses windowlevelnumpy if there is a self.levelarray, else
+        windowlevelpython.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Int
+            The majority level among the pixel levels if the majority is above a certain floor percentage;
+            else, return the max number of levels in the tree.
+        '''
+        if self.levelarray is not None:
+            return self.windowlevelnumpy(x0, x1, y0, y1)
+        return self.windowlevelpython(x0, x1, y0, y1)
+
+    def windowlevelpython(self, x0, x1, y0, y1):
+        '''
+        Version of windowlevel that counts the pixel levels in pure Python. This is the reference engine.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Int
+            The majority level among the pixel levels if the majority is above a certain floor percentage;
+            else, return the max number of levels in the tree.
+        '''
+        dx = 1
+        dy = 1
+        
+        frequency = [0 for i in range(self.numlevels+1)]
+        nvalues = 0
+        for i in range(x0, x1, dx):
+            for j in range(y0, y1, dy):
+                k = self.levels[j][i]
+                k = max(0.0, k)
+                k = int(k)
+                k = min(len(frequency), k)
+                frequency[k] += 1
+                nvalues += 1
+        return self.majority(frequency, nvalues)
+
+    def windowlevelnumpy(self, x0, x1, y0, y1):
+        '''
+        Version of windowlevel that counts the pixel levels in a slice of self.levelarray with numpy.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Int
+            The majority level among the pixel levels if the majority is above a certain floor percentage;
+            else, return the max number of levels in the tree.
+        '''
+        window = self.levelarray[y0:y1, x0:x1]
+        k = np.maximum(window, 0.0).astype(int)
+        k = np.minimum(k, self.numlevels)
+        frequency = np.bincount(k.ravel(), minlength = self.numlevels + 1).tolist()
+        return self.majority(frequency, window.size)
+
+    def makeintegral(self):
+        '''
+        Make self.integral, the summed area tables counting the pixels in each frequency bin, so that the
+        frequencies over any rectangle can be found from four entries of each table.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        '''
+        if self.integral is not None:
+            return
+        self.makelevelarray()
+        bins = np.minimum(np.maximum(self.levelarray, 0.0).astype(int), self.numlevels)
+        self.integral = np.zeros((self.numlevels + 1, self.imheight + 1, self.imwidth + 1), dtype = np.int32)
+        for k in range(self.numlevels + 1):
+            self.integral[k, 1:, 1:] = (bins == k).cumsum(axis = 0, dtype = np.int32).cumsum(axis = 1)
+
+    def integralbytes(self):
+        '''
+        The number of bytes self.integral takes, so that it can be checked before calling makeintegral.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+
+        Returns
+        -------
+        Int
+            The number of bytes.
+        '''
+        return (self.numlevels + 1) * (self.imheight + 1) * (self.imwidth + 1) * 4
+
+    def freeintegral(self):
+        '''
+        Drop self.integral.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        '''
+        self.integral = None
+
+    def windowlevelintegral(self, x0, x1, y0, y1):
+        '''
+        Version of windowlevel using the tables from makeintegral, so the cost doesn't depend on the
+        number of pixels.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Int
+            The majority level among the pixel levels if the majority is above a certain floor percentage;
+            else, return the max number of levels in the tree.
+        '''
+        if x1 <= x0 or y1 <= y0:
+            return self.majority([0 for i in range(self.numlevels+1)], 0)
+        integral = self.integral
+        frequency = integral[:, y1, x1] - integral[:, y0, x1] - integral[:, y1, x0] + integral[:, y0, x0]
+        return self.majority(frequency.tolist(), (x1 - x0) * (y1 - y0))
+
+    def majority(self, frequency, nvalues):
+        '''
+        Find the majority level from the frequencies of the levels. Shared by the windowlevel engines.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        frequency : List of Int
+            The number of pixels with each level.
+        nvalues : Int
+            The total number of pixels.
+
+        Returns
+        -------
+        Int
+            The majority level if it is above the floor percentage self.floorpercent; else, return the
+            max number of levels in the tree.
+        '''
+        floorpercent = self.floorpercent
+        minreturn = self.minreturn
+
+        result = 0
+        maxfrequency = 0
+        someabovefloor = False
+        floor = nvalues * floorpercent
+        for i in range(len(frequency)):
+            if frequency[i] >= maxfrequency:
+                maxfrequency = frequency[i]
+                result = i
+            if frequency[i] > floor:
+                someabovefloor = True
+        if someabovefloor:
+            if result > minreturn:
+                return result
+            else:
+                return minreturn
+        else:
+            return self.numlevels+1
+
+    def makebounds(self, blocksize = 16):
+        '''
+        Over-rides LevelFilter.makebounds. Count the pixels in each frequency bin inside each block, and store
+        the counts as summed area tables over the blocks in self.blockcounts. Then the frequencies over any
+        window of blocks can be found from four rows of bin counts.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        blocksize : Int
+            The width and height in pixels of each block. Smaller blocks decide more sub-rectangles. Blocks
+            of one pixel decide all of them, so then the tables from makeintegral are used instead of
+            making a second copy of them.
+        '''
+        nbins = self.numlevels + 1
+        if blocksize == 1:
+            self.makeintegral()
+            self.blockcounts = self.integral.transpose(1, 2, 0)
+            self.blocksize = 1
+            return
+        nblocksy = -(-self.imheight // blocksize)
+        nblocksx = -(-self.imwidth // blocksize)
+        levels = np.asarray(self.levels, dtype = float)
+        bins = np.minimum(np.maximum(levels, 0.0).astype(int), self.numlevels)
+        inbin = np.zeros((nblocksy * blocksize, nblocksx * blocksize), dtype = np.int32)
+        self.blockcounts = np.zeros((nblocksy + 1, nblocksx + 1, nbins), dtype = np.int32)
+        for k in range(nbins):
+            inbin[:self.imheight, :self.imwidth] = bins == k
+            counts = inbin.reshape(nblocksy, blocksize, nblocksx, blocksize).sum(axis = (1, 3))
+            self.blockcounts[1:, 1:, k] = counts.cumsum(axis = 0).cumsum(axis = 1)
+        self.blocksize = blocksize
+
+    def blockfrequency(self, x0, x1, y0, y1):
+        '''
+        Bounds on the number of pixels in each frequency bin for the pixels with indices x0 <= i < x1 and 
+        y0 <= j < y1 found using self.blockcounts. The lower bounds count the blocks completely inside the
+        pixels. The remaining pixels at the edges can add at most the counts of the other blocks touching
+        the pixels.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        List of Int
+            A lower bound on the number of pixels in each frequency bin.
+        List of Int
+            An upper bound on the number of pixels in each frequency bin.
+        '''
+        size = self.blocksize
+        counts = self.blockcounts
+        (nblocksy, nblocksx) = (counts.shape[0] - 1, counts.shape[1] - 1)
+        bx0 = x0 // size
+        bx1 = -(-x1 // size)
+        by0 = y0 // size
+        by1 = -(-y1 // size)
+        outer = counts[by1, bx1] - counts[by0, bx1] - counts[by1, bx0] + counts[by0, bx0]
+
+        bx0 = -(-x0 // size)
+        by0 = -(-y0 // size)
+        bx1 = nblocksx if x1 >= self.imwidth else x1 // size
+        by1 = nblocksy if y1 >= self.imheight else y1 // size
+        if bx1 <= bx0 or by1 <= by0:
+            inner = np.zeros_like(outer)
+            ninner = 0
+        else:
+            inner = counts[by1, bx1] - counts[by0, bx1] - counts[by1, bx0] + counts[by0, bx0]
+            ninner = (min(bx1 * size, self.imwidth) - bx0 * size) * (min(by1 * size, self.imheight) - by0 * size)
+        nedge = (x1 - x0) * (y1 - y0) - ninner
+        return inner.tolist(), (inner + np.minimum(outer - inner, nedge)).tolist()
+
+    def decidebounds(self, level, x0, x1, y0, y1):
+        '''
+        Decide whether to sub-divide using the bounds on the frequencies from blockfrequency. Every frequency
+        bin whose upper bound is above the floor could be the majority, and if no lower bound is above the
+        floor, then the result could also be the max number of levels. The decision is made if it is the
+        same for all of these possible results of majority.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        level : Int
+            The level of the sub-rectangle.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Bool
+            Whether to sub-divide, or None if the bounds can't decide.
+        '''
+        lower, upper = self.blockfrequency(x0, x1, y0, y1)
+        floor = (x1 - x0) * (y1 - y0) * self.floorpercent
+        possible = [max(i, self.minreturn) for i in range(len(upper)) if upper[i] > floor]
+        if max(lower) <= floor:
+            possible.append(self.numlevels + 1)
+        if level <= min(possible):
+            return True
+        if level > max(possible):
+            return False
+        return None
+
+    def decidesample(self, level, x0, x1, y0, y1):
+        '''
+        Decide whether to sub-divide by estimating the fraction of the pixels in the most frequent level from
+        a sample of the pixels. The decision is only made if that fraction is more than self.margin standard
+        errors away from self.floorpercent.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        level : Int
+            The level of the sub-rectangle.
+        x0 : Int
+            The first x index of the pixels.
+        x1 : Int
+            One past the last x index of the pixels.
+        y0 : Int
+            The first y index of the pixels.
+        y1 : Int
+            One past the last y index of the pixels.
+
+        Returns
+        -------
+        Bool
+            Whether to sub-divide, or None if the estimate is too close to the floor percentage.
+        '''
+        values = self.samplewindow(x0, x1, y0, y1)
+        nvalues = len(values)
+        bins = np.minimum(np.maximum(values, 0.0).astype(int), self.numlevels)
+        frequency = np.bincount(bins, minlength = self.numlevels + 1)
+        # Ties go to the largest level, the same as majority.
+        result = self.numlevels - int(np.argmax(frequency[::-1]))
+        fraction = frequency[result] / nvalues
+        stderror = self.standarderror(fraction * (1.0 - fraction), nvalues)
+        if fraction - self.margin * stderror > self.floorpercent:
+            return level <= max(result, self.minreturn)
+        if fraction + self.margin * stderror < self.floorpercent:
+            return level <= self.numlevels + 1
+        return None
+
+class CircleFilter(LevelFilter):
+    '''
+    Class for creating a max level Hilbert pseudo-curve function that is for drawing randomly
+    placed circles of random radius and random level. Parent class is class LevelFilter.
+
+    Members
+    -------
+    self.levels : 2D array-like
+        Ignored.
+    self.maxlevel : Int
+        Maximum possible level for Hilbert pseudo-curves.
+    self.treewidth : Float
+        Width of rectangular drawing area to put circles.
+    self.treeheight : Float
+        Height of rectangular drawing area to put circles.
+    self.circles : Array-like
+        Each member represents one cirlce. Members are array-likes holding the x position, 
+        y position, radius, and level info of circle.
+    '''
+
+    def __init__(self, levels, maxlevel, treewidth, treeheight):
+        '''
+        Initializer. Creates the list of circles.
+        
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        levels : Int
+            Parameter passed to parent class.
+        maxlevel : Int
+            The maximum level of Hilbert pseudo-curve that a circle will be filled with.
+        treewdith : Float
+            The width of the rectangular area to draw the circles inside.
+        treeheight : Float
+            The height of the rectangular area to draw the circles inside.
+        '''
+
+        super().__init__(levels)
+
+        maxradius = np.sqrt(treewidth**2 + treeheight**2) / 3.0
+        floor = 3
+        self.circles = []
+        for i in range(15):
+            radius = random.random()* maxradius
+            xcenter = random.random()*treewidth
+            ycenter = random.random()*treeheight
+            circlelevel = maxlevel - floor + random.random() * floor
+            self.circles.append([xcenter, ycenter, radius, circlelevel])
+    
+    def circlepointmax(self, pos):
+        '''
+        Given an (x,y) position, find the highest level such that the position is contained in a circle
+        of that level. 
+        
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        pos : Array-like
+            Should contain two members of floating point values representing the x and y coordinate of the point.
+        
+        Returns
+        -------
+        Int 
+            The largest level such that the point is contained in a circle of that level.
+        '''
+        result = 0
+        for i in range(len(self.circles)):
+            thiscircle = self.circles[i]
+            dist = 0.0
+            for j in range(2):
+                dist += (pos[j] - thiscircle[j])**2
+            dist = np.sqrt(dist)
+            if dist < thiscircle[2] and thiscircle[3]>result:
+                result = thiscircle[3]
+        return result
+    
+    def filterfunc(self, pos, width, height):
+        '''
+        Find the largest level of Hilbert pseudo-curve for a given sub-rectangle. This really only depends
+        on the position of the sub-rectangle. Its level is given by the largest level of circle containing the
+        position.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        pos : Array-like
+            Should contain two members of floating point type representing the (x,y) position of the
+            sub-rectangle.
+        width : Float
+            The width of the sub-rectangle.
+        heigh : Float
+            The height of the sub-rectangle.
+
+        Returns
+        -------
+        Int
+            The largest level of Hilbert pseudo-curve associated to the sub-rectangle.
+        '''
+        ncheck = 5
+        result = 0
+        dx = width / ncheck    
+        dy =  height / ncheck 
+
+        checkx = pos[0]
+        checky = pos[1]
+        for i in range(ncheck):
+            for j in range(ncheck):
+                checkpos = [checkx, checky]
+                circlelevel = self.circlepointmax(checkpos) 
+                if circlelevel > result:
+                    result = circlelevel 
+                checky += dy
+            checkx += dx
+
+        return result
+
+    def cellfunc(self, cell, depth):
+        '''
+        Find the largest level of Hilbert pseudo-curve for a sub-rectangle given as a cell index, see
+        LevelFilter.setupcell. The cell is converted to a floating point position, width, and height so that
+        filterfunc can be used.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        cell : Array-like
+            Has two Int members, the x and y index of the cell.
+        depth : Int
+            The number of times the image has been sub-divided to get the cell.
+
+        Returns
+        -------
+        Int
+            The largest level of Hilbert pseudo-curve associated to the cell.
+        '''
+        width = self.imwidth / 2**depth
+        height = self.imheight / 2**depth
+        return self.filterfunc([cell[0] * width, cell[1] * height], width, height)
+
+class FilterRegistry:
+    '''
+    Class for keeping several engines, i.e. implementations of windowlevel, for each type of LevelFilter and
+    choosing the fastest one for a given filter. Each filter type has a reference engine, usually the pure
+    Python loops, that the other engines have to agree with.
+
+    The engines are timed on a sample of cell windows at every depth up to the number of levels, the same
+    sizes of windows a tree build uses. The timings are recorded for each filter type, image size and number
+    of levels, so they only need to be measured once and can be saved to and loaded from a file. Before
+    an engine is used, it is checked against the reference engine on a sample of windows. Engines whose
+    tables would take more than LevelFilter.maxtablebytes are skipped, and the data made for the engines
+    that aren't chosen is freed again.
+
+    Use the module level instance filterregistry, which already has the engines for UseMax, UseAverage,
+    and UseMajority.
+
+    Members
+    -------
+    self.engines : Dictionary
+        Maps each filter class to a dictionary mapping engine names to tuples (windowfunc, prepare, free,
+        tablebytes). windowfunc has the same parameters as LevelFilter.windowlevel. prepare, free and
+        tablebytes are functions taking the filter, or None. prepare makes any data the engine needs, free
+        drops it again, and tablebytes gives the number of bytes prepare would use.
+    self.references : Dictionary
+        Maps each filter class to the name of its reference engine.
+    self.timings : Dictionary
+        Maps a string key for the filter type, image size and number of levels to a dictionary mapping
+        engine names to the estimated number of seconds to filter the sample windows.
+    self.mismatches : List of String
+        The names of engines that didn't agree with the reference engine, as "key:name".
+    '''
+
+    def __init__(self):
+        '''
+        Initializer. Starts without any engines.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        '''
+        self.engines = {}
+        self.references = {}
+        self.timings = {}
+        self.mismatches = []
+
+    def register(self, filterclass, name, windowfunc, prepare = None, reference = False, free = None,
+                 tablebytes = None):
+        '''
+        Register an engine for a filter type.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        filterclass : class
+            A subclass of LevelFilter.
+        name : String
+            The name of the engine.
+        windowfunc : function
+            Has the same parameters as LevelFilter.windowlevel, including the filter as the first parameter.
+        prepare : function
+            Takes the filter and makes any data the engine needs. Use None if nothing is needed.
+        reference : Bool
+            Whether this is the reference engine of the filter type. The first engine registered for a
+            filter type is the reference until another one is given.
+        free : function
+            Takes the filter and drops the data made by prepare. Use None if nothing needs to be dropped.
+        tablebytes : function
+            Takes the filter and returns the number of bytes of the data prepare would make. The engine is
+            skipped for filters where this is more than LevelFilter.maxtablebytes. Use None if the engine
+            is never skipped.
+        '''
+        self.engines.setdefault(filterclass, {})[name] = (windowfunc, prepare, free, tablebytes)
+        if reference or filterclass not in self.references:
+            self.references[filterclass] = name
+
+    def findclass(self, myfilter):
+        '''
+        Find the closest class of a filter that has registered engines.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        myfilter : LevelFilter
+            The filter.
+
+        Returns
+        -------
+        class
+            The class with engines, or None if there is none.
+        '''
+        for filterclass in type(myfilter).__mro__:
+            if filterclass in self.engines:
+                return filterclass
+        return None
+
+    def usable(self, myfilter, name):
+        '''
+        Whether an engine's data fits within the memory limit LevelFilter.maxtablebytes of a filter. The
+        reference engine is always usable.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        myfilter : LevelFilter
+            The filter.
+        name : String
+            The name of the engine.
+
+        Returns
+        -------
+        Bool
+            Whether the engine can be used.
+        '''
+        filterclass = self.findclass(myfilter)
+        tablebytes = self.engines[filterclass][name][3]
+        return name == self.references[filterclass] or tablebytes is None \
+               or tablebytes(myfilter) <= myfilter.maxtablebytes
+
+    def freeengines(self, myfilter, keep = None):
+        '''
+        Drop the data made for the engines of a filter, except for one engine whose data is made again if
+        it was shared with another engine.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        myfilter : LevelFilter
+            The filter.
+        keep : String
+            The name of the engine to keep prepared, or None to drop everything.
+        '''
+        engines = self.engines[self.findclass(myfilter)]
+        for (name, (windowfunc, prepare, free, tablebytes)) in engines.items():
+            if name != keep and free is not None:
+                free(myfilter)
+        if keep is not None and engines[keep][1] is not None:
+            engines[keep][1](myfilter)
+
+    def timingkey(self, myfilter, numlevels):
+        '''
+        The key of self.timings for a filter. Image sizes are rounded to the nearest power of 2 number of pixels.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        myfilter : LevelFilter
+            The filter.
+        numlevels : Int
+            The maximum number of levels of the tree.
+
+        Returns
+        -------
+        String
+            The key.
+        '''
+        sizebucket = round(math.log2(max(1, myfilter.imwidth * myfilter.imheight)))
+        return type(myfilter).__name__ + ':' + str(sizebucket) + ':' + str(numlevels)
+
+    def samplewindows(self, myfilter, numlevels, nsamples, seed):
+        '''
+        Make a sample of pixel windows of the cells at every depth from 0 to numlevels, see
+        LevelFilter.setupcell.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        myfilter : LevelFilter
+            The filter.
+        numlevels : Int
+            The maximum number of levels of the tree.
+        nsamples : Int
+            The number of random cells at each depth.
+        seed : Int
+            The seed of the random numbers, so the sample is always the same.
+
+        Returns
+        -------
+        List of Tuple of Int
+            The windows (x0, x1, y0, y1).
+        '''
+        generator = random.Random(seed)
+        windows = []
+        for depth in range(numlevels + 1):
+            for i in range(nsamples):
+                cell = [generator.randrange(2**depth), generator.randrange(2**depth)]
+                windows.append(myfilter.setupcell(cell, depth))
+        return windows
+
+    def benchmark(self, myfilter, windows, budget, seed):
+        '''
+        Time every usable engine of a filter on a sample of windows. Engines that take longer than the time
+        budget are stopped early, and their total time is estimated from the windows they finished. The
+        windows are shuffled so that the estimate isn't biased by window size. Each engine's data is freed
+        after it is timed.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        myfilter : LevelFilter
+            The filter.
+        windows : List of Tuple of Int
+            The windows (x0, x1, y0, y1).
+        budget : Float
+            The maximum number of seconds to spend on each engine.
+        seed : Int
+            The seed of the random numbers used to shuffle the windows.
+
+        Returns
+        -------
+        Dictionary
+            Maps each engine name to the estimated number of seconds to filter all of the windows.
+        '''
+        shuffled = list(windows)
+        random.Random(seed).shuffle(shuffled)
+        timings = {}
+        for (name, (windowfunc, prepare, free, tablebytes)) in self.engines[self.findclass(myfilter)].items():
+            if not self.usable(myfilter, name):
+                continue
+            if prepare is not None:
+                prepare(myfilter)
+            start = time.perf_counter()
+            ndone = 0
+            for (x0, x1, y0, y1) in shuffled:
+                windowfunc(myfilter, x0, x1, y0, y1)
+                ndone += 1
+                if time.perf_counter() - start > budget:
+                    break
+            timings[name] = (time.perf_counter() - start) * len(shuffled) / max(ndone, 1)
+            if free is not None:
+                free(myfilter)
+        return timings
+
+    def checkwindows(self, myfilter, windows, ncheck, maxcheckpixels, seed):
+        '''
+        Choose the windows to check engines on. These are a sample of the windows with at most maxcheckpixels
+        pixels, and windows where every pixel has the same level. The latter are found by growing squares
+        from random pixels for as long as they stay a single level. Windows with a single level are where
+        the values of an engine are most likely to be exactly on a whole number, which the tree compares
+        them with.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        myfilter : LevelFilter
+            The filter.
+        windows : List of Tuple of Int
+            The windows (x0, x1, y0, y1) from samplewindows.
+        ncheck : Int
+            The number of sample windows, and a quarter of the number of random pixels to grow squares from.
+        maxcheckpixels : Int
+            Only windows with at most this many pixels are checked.
+        seed : Int
+            The seed of the random numbers.
+
+        Returns
+        -------
+        List of Tuple of Int
+            The windows (x0, x1, y0, y1).
+        '''
+        generator = random.Random(seed)
+        small = [window for window in windows 
+                 if 0 < (window[1] - window[0]) * (window[3] - window[2]) <= maxcheckpixels]
+        checked = generator.sample(small, min(ncheck, len(small)))
+        for i in range(4 * ncheck):
+            x = generator.randrange(myfilter.imwidth)
+            y = generator.randrange(myfilter.imheight)
+            size = 1
+            while x + size <= myfilter.imwidth and y + size <= myfilter.imheight and size * size <= maxcheckpixels:
+                values = set([value for row in myfilter.levels[y : y + size] for value in row[x : x + size]])
+                if len(values) > 1:
+                    break
+                checked.append((x, x + size, y, y + size))
+                size += max(1, size // 2)
+        return checked
+
+    def check(self, myfilter, name, windows, numlevels):
+        '''
+        Check that an engine makes the same decisions as the reference engine on some windows. The tree
+        sub-divides when level <= windowlevel(x0, x1, y0, y1), so the values of the two engines are compared
+        against every level from 0 to numlevels + 1, not just up to floating point rounding.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        myfilter : LevelFilter
+            The filter. The engines should already be prepared.
+        name : String
+            The name of the engine to check.
+        windows : List of Tuple of Int
+            The windows (x0, x1, y0, y1).
+        numlevels : Int
+            The maximum number of levels of the tree.
+
+        Returns
+        -------
+        Bool
+            Whether the engine makes the same decisions as the reference engine.
+        '''
+        engines = self.engines[self.findclass(myfilter)]
+        windowfunc = engines[name][0]
+        referencefunc = engines[self.references[self.findclass(myfilter)]][0]
+        for (x0, x1, y0, y1) in windows:
+            value = windowfunc(myfilter, x0, x1, y0, y1)
+            referencevalue = referencefunc(myfilter, x0, x1, y0, y1)
+            for level in range(numlevels + 2):
+                if (level <= value) != (level <= referencevalue):
+                    return False
+        return True
+
+    def select(self, myfilter, numlevels, nsamples = 4, ncheck = 16, maxcheckpixels = 65536, budget = 0.2, seed = 0):
+        '''
+        Choose the fastest usable engine for a filter that agrees with the reference engine, and make the
+        filter use it with LevelFilter.useengine. The engines are benchmarked only if there are no recorded
+        timings for the same filter type, image size and number of levels. Only the data of the chosen
+        engine is kept.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        myfilter : LevelFilter
+            The filter.
+        numlevels : Int
+            The maximum number of levels of the tree.
+        nsamples : Int
+            The number of sample cells at each depth to benchmark with.
+        ncheck : Int
+            The number of windows of each kind from checkwindows to check against the reference engine.
+        maxcheckpixels : Int
+            Only windows with at most this many pixels are checked, so that checking with a slow reference
+            engine stays cheap.
+        budget : Float
+            The maximum number of seconds to spend benchmarking each engine.
+        seed : Int
+            The seed of the random numbers, so the choice is reproducible.
+
+        Returns
+        -------
+        String
+            The name of the engine chosen, or None if the filter type has no engines.
+        '''
+        filterclass = self.findclass(myfilter)
+        if filterclass is None:
+            return None
+        engines = self.engines[filterclass]
+        windows = self.samplewindows(myfilter, numlevels, nsamples, seed)
+        key = self.timingkey(myfilter, numlevels)
+        if key not in self.timings:
+            self.timings[key] = self.benchmark(myfilter, windows, budget, seed)
+
+        checkwindows = self.checkwindows(myfilter, windows, ncheck, maxcheckpixels, seed)
+        reference = self.references[filterclass]
+        ranked = sorted([name for name in self.timings[key] if name in engines and self.usable(myfilter, name)],
+                        key = self.timings[key].get)
+        for name in ranked + [reference]:
+            (windowfunc, prepare, free, tablebytes) = engines[name]
+            if prepare is not None:
+                prepare(myfilter)
+            if name == reference or self.check(myfilter, name, checkwindows, numlevels):
+                self.freeengines(myfilter, name)
+                myfilter.useengine(name, windowfunc)
+                return name
+            self.mismatches.append(key + ':' + name)
+            if free is not None:
+                free(myfilter)
+
+    def savetimings(self, filename):
+        '''
+        Save the recorded timings to a JSON file.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        filename : String
+            The name of the file.
+        '''
+        with open(filename, 'w') as timingfile:
+            json.dump(self.timings, timingfile, indent = 1)
+
+    def loadtimings(self, filename):
+        '''
+        Load timings from a JSON file made by savetimings, adding them to the recorded timings.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        filename : String
+            The name of the file.
+        '''
+        with open(filename) as timingfile:
+            self.timings.update(json.load(timingfile))
+
+filterregistry = FilterRegistry()
+filterregistry.register(UseMax, 'python', UseMax.windowlevelpython, reference = True)
+filterregistry.register(UseMax, 'numpy', UseMax.windowlevelnumpy, LevelFilter.makelevelarray,
+                        free = LevelFilter.freelevelarray)
+filterregistry.register(UseAverage, 'python', UseAverage.windowlevelpython, reference = True)
+filterregistry.register(UseAverage, 'numpy', UseAverage.windowlevelnumpy, LevelFilter.makelevelarray,
+                        free = LevelFilter.freelevelarray)
+filterregistry.register(UseAverage, 'integral', UseAverage.windowlevelintegral, UseAverage.makeintegral,
+                        free = UseAverage.freeintegral, tablebytes = UseAverage.integralbytes)
+filterregistry.register(UseMajority, 'python', UseMajority.windowlevelpython, reference = True)
+filterregistry.register(UseMajority, 'numpy', UseMajority.windowlevelnumpy, LevelFilter.makelevelarray,
+                        free = LevelFilter.freelevelarray)
+filterregistry.register(UseMajority, 'integral', UseMajority.windowlevelintegral, UseMajority.makeintegral,
+                        free = UseMajority.freeintegral, tablebytes = UseMajority.integralbytes)
+
+class PlotterExport:
+    '''
+    Class for streaming the positions of a Hilbert pseudo-curve to a pen plotter as G-code or HPGL. Runs of
+    consecutive collinear moves in the same direction are merged into one move, and optionally the path
+    is simplified using the Douglas-Peucker algorithm with a given tolerance. A reasonable tolerance is
+    at most the size of the smallest leaf sub-rectangle, so that the curve doesn't cross itself.
+
+    The output is written in chunks directly from an iterator of positions, e.g.
+    HilbertTreeMaxed.iteratepositions, so the whole curve never needs to be held in memory.
+
+    Members
+    -------
+    self.format : String
+        Either 'gcode' or 'hpgl'.
+    self.tolerance : Float
+        The tolerance for Douglas-Peucker simplification. A value of 0 only merges collinear moves.
+    self.chunksize : Int
+        The number of merged points to simplify and write at one time.
+    self.scale : Float
+        Multiplies every coordinate before it is written, e.g. to convert pixels to millimeters or
+        HPGL plotter units. HPGL coordinates are rounded to whole plotter units after scaling.
+    self.feedrate : Float
+        The G-code feed rate used for pen down moves. Ignored for HPGL.
+    self.nmovesin : Int
+        The number of positions read during the last export.
+    self.nmovesout : Int
+        The number of positions written during the last export.
+    '''
+
+    def __init__(self, format = 'gcode', tolerance = 0.0, chunksize = 1000, scale = None, feedrate = 1000.0):
+        '''
+        Initializer.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        format : String
+            Either 'gcode' or 'hpgl'.
+        tolerance : Float
+            The tolerance for Douglas-Peucker simplification. Use 0 to only merge collinear moves.
+        chunksize : Int
+            The number of merged points to simplify and write at one time. Must be at least 2.
+        scale : Float
+            Multiplies every coordinate before it is written. If None, then 1.0 is used for G-code, and 40.0
+            is used for HPGL, i.e. one pixel is one millimeter in plotter units of 0.025 mm, so that 
+            sub-pixel positions aren't lost when rounding to whole plotter units.
+        feedrate : Float
+            The G-code feed rate used for pen down moves.
+        '''
+        if format not in ['gcode', 'hpgl']:
+            raise ValueError('format must be gcode or hpgl')
+        if chunksize < 2:
+            raise ValueError('chunksize must be at least 2')
+        self.format = format
+        self.tolerance = tolerance
+        self.chunksize = chunksize
+        if scale is None:
+            scale = 40.0 if format == 'hpgl' else 1.0
+        self.scale = scale
+        self.feedrate = feedrate
+        self.nmovesin = 0
+        self.nmovesout = 0
+
+    def mergecollinear(self, positions):
+        '''
+        Generator that removes the middle points of runs of consecutive collinear positions that go in the
+        same direction. Also counts the number of positions read in self.nmovesin.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        positions : Iterable of Array-like
+            The positions of the curve in order.
+
+        Returns
+        -------
+        Generator of Array-like
+            The positions of the curve with collinear runs merged.
+        '''
+        start = None
+        last = None
+        for position in positions:
+            self.nmovesin += 1
+            if start is None:
+                start = position
+                yield position
+                continue
+            if last is None:
+                last = position
+                continue
+            ax = last[0] - start[0]
+            ay = last[1] - start[1]
+            bx = position[0] - last[0]
+            by = position[1] - last[1]
+            if ax * by - ay * bx == 0 and ax * bx + ay * by > 0:
+                last = position
+                continue
+            yield last
+            start = last
+            last = position
+        if last is not None:
+            yield last
+
+    def simplify(self, points):
+        '''
+        Simplify a list of points using the Douglas-Peucker algorithm with tolerance self.tolerance.
+        The first and last points are always kept.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        points : List of Array-like
+            The points to simplify.
+
+        Returns
+        -------
+        List of Array-like
+            The points that are kept, in their original order.
+        '''
+        if self.tolerance <= 0 or len(points) < 3:
+            return points
+        keep = [False for i in range(len(points))]
+        keep[0] = True
+        keep[-1] = True
+        stack = [(0, len(points) - 1)]
+        while stack:
+            first, last = stack.pop()
+            x0, y0 = points[first][0], points[first][1]
+            dx = points[last][0] - x0
+            dy = points[last][1] - y0
+            length = np.sqrt(dx**2 + dy**2)
+            maxdist = -1.0
+            maxindex = first
+            for i in range(first + 1, last):
+                px = points[i][0] - x0
+                py = points[i][1] - y0
+                if length > 0:
+                    dist = abs(dx * py - dy * px) / length
+                else:
+                    dist = np.sqrt(px**2 + py**2)
+                if dist > maxdist:
+                    maxdist = dist
+                    maxindex = i
+            if maxdist > self.tolerance:
+                keep[maxindex] = True
+                stack.append((first, maxindex))
+                stack.append((maxindex, last))
+        return [points[i] for i in range(len(points)) if keep[i]]
+
+    def simplifiedpositions(self, positions):
+        '''
+        Generator that merges collinear moves and then simplifies the result one chunk at a time. The last
+        point of each chunk is used as the first point of the next chunk, so chunk boundaries are kept.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        positions : Iterable of Array-like
+            The positions of the curve in order.
+
+        Returns
+        -------
+        Generator of List of Array-like
+            Chunks of simplified points. Together they make the whole simplified curve.
+        '''
+        chunk = []
+        for point in self.mergecollinear(positions):
+            chunk.append(point)
+            if len(chunk) >= self.chunksize:
+                simplified = self.simplify(chunk)
+                yield simplified[:-1]
+                chunk = [chunk[-1]]
+        if chunk:
+            yield self.simplify(chunk)
+
+    def formatpoint(self, point):
+        '''
+        Convert a point to scaled coordinates as they should be written.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        point : Array-like
+            Has two members, the x and y position.
+
+        Returns
+        -------
+        String
+            For HPGL, the integer coordinates 'x,y'. For G-code, 'X<x> Y<y>'.
+        '''
+        x = point[0] * self.scale
+        y = point[1] * self.scale
+        if self.format == 'hpgl':
+            return str(int(round(x))) + ',' + str(int(round(y)))
+        return 'X' + format(x, '.4f') + ' Y' + format(y, '.4f')
+
+    def export(self, positions, stream):
+        '''
+        Write the curve to a stream as G-code or HPGL. The positions are read, simplified and written
+        in chunks.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        positions : Iterable of Array-like
+            The positions of the curve in order, e.g. from HilbertTreeMaxed.iteratepositions.
+        stream : File-like
+            The text stream to write to.
+
+        Returns
+        -------
+        Float
+            The fraction of moves removed, i.e. 1 - self.nmovesout / self.nmovesin. Points that are the
+            same as the previous point after formatting, e.g. after rounding to plotter units, aren't
+            written.
+        '''
+        self.nmovesin = 0
+        self.nmovesout = 0
+        if self.format == 'hpgl':
+            stream.write('IN;SP1;')
+        else:
+            stream.write('G21\nG90\n')
+
+        previous = None
+        for chunk in self.simplifiedpositions(positions):
+            lines = []
+            for point in chunk:
+                formatted = self.formatpoint(point)
+                if formatted == previous:
+                    continue
+                previous = formatted
+                if self.format == 'hpgl':
+                    if self.nmovesout == 0:
+                        lines.append('PU' + formatted + ';PD')
+                    elif self.nmovesout == 1:
+                        lines.append(formatted)
+                    else:
+                        lines.append(',' + formatted)
+                elif self.nmovesout == 0:
+                    lines.append('G0 ' + formatted + '\nM3\n')
+                else:
+                    lines.append('G1 ' + formatted + ' F' + str(self.feedrate) + '\n')
+                self.nmovesout += 1
+            stream.write(''.join(lines))
+
+        if self.format == 'hpgl':
+            # Only end the pen down command if one was started.
+            if self.nmovesout > 0:
+                stream.write(';')
+            stream.write('PU;SP0;\n')
+        else:
+            stream.write('M5\n')
+
+        if self.nmovesin == 0:
+            return 0.0
+        return 1.0 - self.nmovesout / self.nmovesin
+
+class FrameSequence:
+    '''
+    Class for drawing a sequence of video frames where consecutive frames only differ slightly. Instead of
+    re-building the whole tree for every frame, the level arrays of consecutive frames are compared in square
+    tiles. Sub-trees of the previous frame's tree whose sub-rectangles don't touch a changed tile are re-used
+    as they are, and their leaf positions are copied as a single run from the previous frame's positions.
+    Only the sub-rectangles touching changed tiles are filtered and sub-divided again.
+
+    This requires that the filter for a sub-rectangle only depends on the pixel levels inside the
+    sub-rectangle, as is the case for UseMax, UseAverage and UseMajority. It doesn't hold for CircleFilter.
+    Since LevelFilter.setupxy truncates positions, the window of a descendant can reach past the window of
+    its ancestor, so sub-trees are compared using the conservative footprint from touchchanged.
+
+    Every node of every frame's tree uses framefunc as its max level function, which calls the filter of
+    the current frame. So re-used sub-trees never need their nodes updated for a new frame.
+
+    Members
+    -------
+    self.makefilter : function
+        Function taking a 2D array of pixel levels and returning the max level function to use for
+        HilbertTreeMaxed, e.g. lambda levels : UseMajority(levels, numlevels).filterfunc.
+    self.numlevels : Int
+        The global maximum number of levels to make the trees.
+    self.tilesize : Int
+        The width and height in pixels of the tiles used to compare frames.
+    self.filterfunc : function
+        The max level function made by self.makefilter for the current frame. Is None before the first
+        frame.
+    self.previouslevels : 2D numpy array
+        The pixel levels of the previous frame. Is None before the first frame.
+    self.previoustree : HilbertTreeMaxed
+        The root of the tree of the previous frame. Is None before the first frame.
+    self.previouspositions : List of Array-like
+        The leaf positions of the previous frame in curve order.
+    self.changed : 2D numpy array of Bool
+        For each tile, whether it changed between the previous frame and the current frame.
+    self.reusedstarts : Dictionary
+        Maps the id of every re-used sub-tree root to the index of its first leaf in self.previouspositions.
+    self.nreused : Int
+        The number of leaves re-used from the previous frame when building the last frame.
+    self.check : Bool
+        Whether buildframe should compare every frame with a fresh build of the whole tree.
+    '''
+
+    def __init__(self, makefilter, numlevels, tilesize = 16, check = False):
+        '''
+        Initializer.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        makefilter : function
+            Function taking a 2D array of pixel levels and returning the max level function to use for
+            HilbertTreeMaxed.
+        numlevels : Int
+            The global maximum number of levels to make the trees.
+        tilesize : Int
+            The width and height in pixels of the tiles used to compare frames.
+        check : Bool
+            Whether buildframe should compare every frame with a fresh build of the whole tree. This is
+            slow and only meant for debugging.
+        '''
+        self.makefilter = makefilter
+        self.numlevels = numlevels
+        self.tilesize = tilesize
+        self.filterfunc = None
+        self.previouslevels = None
+        self.previoustree = None
+        self.previouspositions = []
+        self.changed = None
+        self.reusedstarts = {}
+        self.nreused = 0
+        self.check = check
+
+    def changedtiles(self, levels):
+        '''
+        Compare the pixel levels of a frame with those of the previous frame.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        levels : 2D numpy array
+            The pixel levels of the new frame.
+
+        Returns
+        -------
+        2D numpy array of Bool
+            For each tile, whether any pixel level inside it changed. Is None if there is no previous frame
+            of the same dimensions.
+        '''
+        if self.previouslevels is None or self.previouslevels.shape != levels.shape:
+            return None
+        different = levels != self.previouslevels
+        (height, width) = different.shape
+        ntilesy = -(-height // self.tilesize)
+        ntilesx = -(-width // self.tilesize)
+        padded = np.zeros((ntilesy * self.tilesize, ntilesx * self.tilesize), dtype = bool)
+        padded[:height, :width] = different
+        padded = padded.reshape(ntilesy, self.tilesize, ntilesx, self.tilesize)
+        return padded.any(axis = (1, 3))
+
+    def touchchanged(self, node):
+        '''
+        Whether the pixels used to filter a sub-rectangle or any of its descendants touch a changed tile.
+        LevelFilter.setupxy truncates the position before adding the width, so a descendant's window can end
+        past the truncated window of the sub-rectangle. Instead the footprint from floor(position) to
+        ceil(position + size) + 1 is used, which contains the windows of all descendants.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        node : HilbertTreeMaxed
+            The node of the sub-rectangle.
+
+        Returns
+        -------
+        Bool
+            Whether the sub-rectangle touches a changed tile.
+        '''
+        (height, width) = self.previouslevels.shape
+        x0 = max(math.floor(node.position[0]), 0)
+        x1 = min(math.ceil(node.position[0] + node.width) + 1, width)
+        y0 = max(math.floor(node.position[1]), 0)
+        y1 = min(math.ceil(node.position[1] + node.height) + 1, height)
+        if x1 <= x0 or y1 <= y0:
+            return False
+        tile = self.tilesize
+        return bool(self.changed[y0 // tile : (y1 - 1) // tile + 1, x0 // tile : (x1 - 1) // tile + 1].any())
+
+    def rebuild(self, node, oldnode, oldstart):
+        '''
+        Recursively build the children of a node of the new tree that touches a changed tile. Children
+        that don't touch a changed tile are replaced by the corresponding sub-trees of the old tree.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        node : HilbertTreeMaxed
+            The node of the new tree.
+        oldnode : HilbertTreeMaxed
+            The node of the old tree with the same sub-rectangle.
+        oldstart : Int
+            The index of the first leaf of oldnode in self.previouspositions.
+        '''
+        if not node.subdivides(self.numlevels):
+            return
+        node.makechildren()
+        for i in range(4):
+            if not oldnode.children:
+                node.children[i].generatechildren(self.numlevels)
+                continue
+            oldchild = oldnode.children[i]
+            if self.touchchanged(node.children[i]):
+                self.rebuild(node.children[i], oldchild, oldstart)
+            else:
+                node.children[i] = oldchild
+                self.reusedstarts[id(oldchild)] = oldstart
+                self.nreused += oldchild.numleaves
+            oldstart += oldchild.numleaves
+        node.numleaves = sum([node.children[i].numleaves for i in range(4)])
+
+    def framefunc(self, pos, width, height):
+        '''
+        The max level function shared by the nodes of all of the trees. Calls self.filterfunc, the filter of
+        the current frame, so the filters of older frames and their pixel levels aren't kept alive by
+        re-used nodes.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        pos : Array-like
+            Has two members representing the x and y positions of the corner of the sub-rectangle.
+        width : Float
+            The width of the sub-rectangle.
+        height : Float
+            The height of the sub-rectangle.
+
+        Returns
+        -------
+        Int
+            The max level from the filter of the current frame.
+        '''
+        return self.filterfunc(pos, width, height)
+
+    def checkframe(self, levels, positions):
+        '''
+        Compare the leaf positions of a frame with those of a fresh build of the whole tree.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        levels : 2D numpy array
+            The pixel levels of the frame.
+        positions : List of Array-like
+            The leaf positions found by buildframe.
+
+        Returns
+        -------
+        Bool
+            Whether the positions are the same as those of the fresh build.
+        '''
+        (height, width) = levels.shape
+        tree = HilbertTreeMaxed(SquareSymmetry(0,0), 0, [0,0], width, height, self.makefilter(levels))
+        tree.generatechildren(self.numlevels)
+        freshpositions = []
+        tree.generatepositions(freshpositions)
+        if len(freshpositions) != len(positions):
+            return False
+        return all([tuple(a) == tuple(b) for (a, b) in zip(freshpositions, positions)])
+
+    def collectpositions(self, node, currentlist):
+        '''
+        Recursively add the leaf positions of a node of the new tree to a list. The positions of re-used
+        sub-trees are copied as one run from the positions of the previous frame.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        node : HilbertTreeMaxed
+            The node of the new tree.
+        currentlist : List
+            The list of positions to add the leaf positions to.
+        '''
+        start = self.reusedstarts.get(id(node))
+        if start is not None:
+            currentlist.extend(self.previouspositions[start : start + node.numleaves])
+        elif not node.children:
+            currentlist.append(node.position)
+        else:
+            for i in range(4):
+                self.collectpositions(node.children[i], currentlist)
+
+    def buildframe(self, levels):
+        '''
+        Build the tree and leaf positions of the next frame, re-using what is unchanged from the previous
+        frame.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        levels : 2D Array-like
+            The pixel levels of the new frame.
+
+        Returns
+        -------
+        HilbertTreeMaxed
+            The root of the tree for the new frame.
+        List of Array-like
+            The leaf positions of the new frame in curve order.
+        '''
+        levels = np.array(levels, dtype = float)
+        (height, width) = levels.shape
+        self.changed = self.changedtiles(levels)
+        self.reusedstarts = {}
+        self.nreused = 0
+
+        if self.changed is not None and not self.changed.any():
+            # The previous tree and its filter already use the same pixel levels, so keep them as they are.
+            self.nreused = self.previoustree.numleaves
+            if self.check and not self.checkframe(levels, self.previouspositions):
+                raise RuntimeError('re-used frame differs from a fresh build')
+            return self.previoustree, self.previouspositions
+
+        self.filterfunc = self.makefilter(levels)
+        tree = HilbertTreeMaxed(SquareSymmetry(0,0), 0, [0,0], width, height, self.framefunc)
+        positions = []
+        if self.changed is None:
+            tree.generatechildren(self.numlevels)
+            tree.generatepositions(positions)
+        else:
+            self.rebuild(tree, self.previoustree, 0)
+            self.collectpositions(tree, positions)
+        if self.check and not self.checkframe(levels, positions):
+            raise RuntimeError('re-built frame differs from a fresh build')
+
+        self.previouslevels = levels
+        self.previoustree = tree
+        self.previouspositions = positions
+        return tree, positions
+
+    def putitem(self, outqueue, item, stop):
+        '''
+        Put an item into a queue, waiting while the queue is full unless the pipeline is stopped.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        outqueue : queue.Queue
+            The queue to put the item into.
+        item : Object
+            The item to put.
+        stop : threading.Event
+            Set when the pipeline is stopped.
+
+        Returns
+        -------
+        Bool
+            True if the item was put into the queue, or False if the pipeline was stopped first.
+        '''
+        while not stop.is_set():
+            try:
+                outqueue.put(item, timeout = 0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def runstage(self, func, items, outqueue, stop):
+        '''
+        Apply a function to every item and put the results into a queue, followed by None to mark the end.
+        If the function raises an exception, then the exception is put into the queue instead. This is
+        run in its own thread for each stage of the pipeline in run, and returns early when stop is set.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        func : function
+            The function to apply.
+        items : Iterable
+            The items to apply the function to.
+        outqueue : queue.Queue
+            The queue to put the results into.
+        stop : threading.Event
+            Set when the pipeline is stopped.
+        '''
+        try:
+            for item in items:
+                if not self.putitem(outqueue, (func(item),), stop):
+                    return
+        except Exception as error:
+            self.putitem(outqueue, error, stop)
+            return
+        self.putitem(outqueue, None, stop)
+
+    def queueitems(self, inqueue, stop):
+        '''
+        Generator of the results put into a queue by runstage. Re-raises any exception from the stage.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        inqueue : queue.Queue
+            The queue to read from.
+        stop : threading.Event
+            Set when the pipeline is stopped. The generator then ends without waiting for more results.
+
+        Returns
+        -------
+        Generator
+            The results in the order they were put into the queue.
+        '''
+        while not stop.is_set():
+            try:
+                item = inqueue.get(timeout = 0.1)
+            except queue.Empty:
+                continue
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item[0]
+
+    def run(self, frames, decode, preprocess, render, queuesize = 4):
+        '''
+        Generator that pipelines decoding, preprocessing, building and rendering of a sequence of frames. Each
+        stage runs in its own thread and hands its results to the next stage through a queue holding at most
+        queuesize frames, so memory use stays bounded. Building is done in order with buildframe. If the
+        generator is closed before the end, e.g. by breaking out of a loop over it, the stage threads stop.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        frames : Iterable
+            The frames, e.g. file names of images.
+        decode : function
+            Takes a frame and returns its pixel colors.
+        preprocess : function
+            Takes the pixel colors of a frame and returns its pixel levels as a 2D array-like.
+        render : function
+            Takes the tree and list of leaf positions of a frame and returns the rendered result.
+        queuesize : Int
+            The maximum number of frames waiting between two stages.
+
+        Returns
+        -------
+        Generator
+            The rendered results in the order of the frames.
+        '''
+        decoded = queue.Queue(queuesize)
+        preprocessed = queue.Queue(queuesize)
+        built = queue.Queue(queuesize)
+        stop = threading.Event()
+        stages = [(decode, frames, decoded),
+                  (preprocess, self.queueitems(decoded, stop), preprocessed),
+                  (self.buildframe, self.queueitems(preprocessed, stop), built)]
+        threads = [threading.Thread(target = self.runstage, args = (func, items, outqueue, stop), daemon = True)
+                   for (func, items, outqueue) in stages]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for (tree, positions) in self.queueitems(built, stop):
+                yield render(tree, positions)
+        finally:
+            stop.set()
+
+class RenderWorker:
+    '''
+    Class for a long-lived local render worker. It listens on a Unix socket, so that a front-end doesn't
+    have to start a new Python process and decode the image for every request. Decoded images and their
+    filters, including any precomputed filter data such as the bounds from LevelFilter.makebounds, are
+    kept in a least recently used cache. Requests for the same image that arrive within a short time of
+    each other are handled as one batch, so the image is decoded once and each distinct number of levels
+    is only built once.
+
+    The protocol is one JSON object per line. A request looks like 
+        {"image" : "hilbertcartoon.png", "numlevels" : 7, "filter" : "majority"}.
+    Image names are paths relative to a root directory, and paths leading outside of it are refused, as
+    are numbers of levels above a maximum.
+    The worker answers with lines {"positions" : [[x, y], ...]} holding chunks of the curve in order, 
+    and then a final line {"done" : true, "numleaves" : n}. If something goes wrong, then the final line
+    is {"error" : message} instead. Use RenderClient to send requests.
+
+    Members
+    -------
+    self.socketpath : String
+        The path of the Unix socket to listen on.
+    self.cachebytes : Int
+        The maximum number of bytes of decoded images and filters to keep in the cache. The most recently
+        used entry is always kept, even if it is larger.
+    self.maxlevels : Int
+        The largest number of levels a request may ask for.
+    self.imageroot : String
+        The absolute path of the directory that image names are relative to.
+    self.batchwindow : Float
+        The number of seconds to wait for more requests for the same image before handling a batch.
+    self.chunksize : Int
+        The number of positions to send in each line of the answer.
+    self.decode : function
+        Takes the path of the image from a request and returns the inverted black and white pixel colors as a
+        2D array-like.
+    self.filters : Dictionary
+        Maps the filter name from a request to a function taking the pixel levels and the number of
+        levels and returning a LevelFilter.
+    self.cache : collections.OrderedDict
+        The cache, ordered from least to most recently used. Maps keys to pairs of the value and its size in
+        bytes. Filters are cached with their precomputed bounds and with the engine chosen by filterregistry
+        already prepared.
+    self.cachedbytes : Int
+        The total size in bytes of the values in the cache.
+    self.pending : Dictionary
+        Maps each image name to the batch of requests waiting for it.
+    self.lock : threading.Lock
+        Protects self.cache, self.pending, and the statistics.
+    self.nrequests : Int
+        The number of requests handled.
+    self.nbatches : Int
+        The number of batches handled.
+    self.nbuilds : Int
+        The number of trees built.
+    self.server : socketserver.ThreadingUnixStreamServer
+        The server while the worker is running, else None.
+    '''
+
+    def __init__(self, socketpath, cachebytes = 256 * 2**20, batchwindow = 0.01, chunksize = 4096, decode = None,
+                 maxlevels = 12, imageroot = None):
+        '''
+        Initializer.
+
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        socketpath : String
+            The path of the Unix socket to listen on.
+        cachebytes : Int
+            The maximum number of bytes of decoded images and filters to keep in the cache.
+        batchwindow : Float
+            The number of seconds to wait for more requests for the same image before handling a batch.
+        chunksize : Int
+            The number of positions to send in each line of the answer.
+        decode : function
+            Takes the path of the image from a request and returns the inverted black and white pixel colors.
+            If None, then RenderWorker.decodeimage is used.
+        maxlevels : Int
+            The largest number of levels a request may ask for.
+        imageroot : String
+            The directory that image names are relative to. If None, then the current working directory
+            is used.
+        '''
+        self.socketpath = socketpath
+        self.cachebytes = cachebytes
+        self.maxlevels = maxlevels
+        self.imageroot = os.path.realpath(imageroot if imageroot is not None else os.getcwd())
+        self.batchwindow = batchwindow
+        self.chunksize = chunksize
+        self.decode = decode if decode is not None else RenderWorker.decodeimage
+        self.filters = {'max' : lambda levels, numlevels : UseMax(levels),
+                        'average' : lambda levels, numlevels : UseAverage(levels),
+                        'majority' : lambda levels, numlevels : UseMajority(levels, numlevels)}
+        self.cache = collections.OrderedDict()
+        self.cachedbytes = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.nrequests = 0
+        self.nbatches = 0
+        self.nbuilds = 0
+        self.server = None
+
+    def decodeimage(image):
+        '''
+        Open an image file as a black and white image and invert its colors, the same way as main.py.
+        Requires PIL.
+
+        Parameters
+        ----------
+        image : String
+            The file name of the image.
+
+        Returns
+        -------
+        2D List of Int
+            The inverted pixel colors.
+        '''
+        from PIL import Image
+
+        myimage = Image.open(image).convert('LA')
+        flatlist = list(myimage.getdata())
+        (imwidth, imheight) = myimage.size
+        return [ [ImageProcessing.invertcolor(flatlist[imwidth*i + j]) for j in range(imwidth)] 
+                 for i in range(imheight)]
+
+    def sizeof(value):
+        '''
+        The number of bytes of the numpy arrays held by a cached value, i.e. a numpy array or the members
+        of a LevelFilter. Arrays that are views of the same data are only counted once.
+
+        Parameters
+        ----------
+        value : Object
+            The value.
+
         Returns
         -------
         Int
-            Maximum pixel level for all of the pixels contained within the rectangle defined by the
-            position sub-rectangle, the sub-rectangles width, and the sub-rectangles height.
+            The number of bytes.
         '''
-        floorlevel = 0
-        levelsmax = 0
-        self.setupxy(pos, width, height)
-        
-        for i in range(self.x0, self.x1, 1):
-            for j in range(self.y0, self.y1, 1):
-                if self.levels[j][i] > levelsmax:
-                    levelsmax = self.levels[j][i]
-        if levelsmax < floorlevel:
-            return floorlevel
-        else:
-            return levelsmax 
+        members = [value] if isinstance(value, np.ndarray) else list(vars(value).values())
+        owners = {}
+        for member in members:
+            if isinstance(member, np.ndarray):
+                owner = member if not isinstance(member.base, np.ndarray) else member.base
+                owners[id(owner)] = owner.nbytes
+        return sum(owners.values())
 
-class UseAverage(LevelFilter):
-    '''
-    Class for defining the maximum Hilbert pseudo-curve level to be the average of the pixel levels 
-    for those pixels that occur within the sub-rectangle.
-    
-    Parent class is LevelFilter, and the class UseAverage contains no member variables not in LevelFilter.
-    '''
+    def cached(self, key, compute):
+        '''
+        Look up a key in the cache, computing and storing the value if it isn't there. The least recently used
+        values are removed while the cache holds more than self.cachebytes bytes.
 
-    def filterfunc(self, pos, width, height):
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        key : Tuple
+            The key of the value.
+        compute : function
+            Takes no parameters and returns the value.
+
+        Returns
+        -------
+        Object
+            The value for the key.
         '''
-        Function giving the maximum Hilbert pseudo-curve level for the sub-rectangle of a given position, width,
-        and height. The max level is the average of all of the pixel level data for the pixels within the
-        rectangle of the same position, width, and height. 
-    
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key][0]
+        value = compute()
+        nbytes = RenderWorker.sizeof(value)
+        with self.lock:
+            if key in self.cache:
+                self.cachedbytes -= self.cache.pop(key)[1]
+            self.cache[key] = (value, nbytes)
+            self.cachedbytes += nbytes
+            while self.cachedbytes > self.cachebytes and len(self.cache) > 1:
+                self.cachedbytes -= self.cache.popitem(last = False)[1][1]
+        return value
+
+    def imagepath(self, image):
+        '''
+        Find the path of an image name relative to self.imageroot, refusing names that lead outside of it.
+
         Parameters
         ----------
         self : self
             Implicit reference to self.
-        pos : Array-like
-            Should have two floating points values representing the x and y position of the sub-rectangle.
-        width : Float
-            The width of the sub-rectangle.
-        height : Float
-            The height of the sub-rectangle. 
+        image : String
+            The image name from a request.
 
         Returns
         -------
-        Float
-            Maximum level for Hilbert pseudo-curves for given sub-rectangle; is the average of all pixel levels
-            for pixels within rectangle of same position, width, and height as the sub-rectangle.
+        String
+            The absolute path of the image.
         '''
-        dx = 1
-        dy = 1
-        average = 0
-        nvalues = 0
-        self.setupxy(pos, width, height)
+        path = os.path.realpath(os.path.join(self.imageroot, str(image)))
+        if os.path.commonpath([path, self.imageroot]) != self.imageroot:
+            raise ValueError('image ' + str(image) + ' is outside of the image root')
+        return path
 
-        for i in range(self.x0, self.x1, dx):
-            for j in range(self.y0, self.y1, dy):
-                average += self.levels[j][i]
-                nvalues += 1
-        if nvalues > 0:
-            average /= nvalues
-        else:
-            average = 0
+    def getfilter(self, image, numlevels, filtername):
+        '''
+        Get the filter for an image and number of levels from the cache, decoding the image and computing
+        the filter and its bounds if necessary. If the image is a file, then its modification time is part
+        of the key, so changed files are decoded again. The image should already be checked by imagepath.
 
-        return average 
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        image : String
+            The image name.
+        numlevels : Int
+            The maximum level of Hilbert pseudo-curve.
+        filtername : String
+            A key of self.filters.
 
-class UseMajority(LevelFilter):
-    '''
-    Class for using the majority of levels of pixels within sub-rectangle to determine the max level of Hilbert
-    pseudo-curve. Uses the pixel data that is contained in the rectangle defined by the sub-rectangle's position,
-    width, and height to find the max level. The max level is defined to be the majority level over all of this
-    subset of data.
+        Returns
+        -------
+        LevelFilter
+            The filter for the pixel levels of the image.
+        '''
+        if filtername not in self.filters:
+            raise ValueError('unknown filter ' + str(filtername))
+        version = os.path.getmtime(image) if os.path.isfile(image) else None
+        bw = self.cached(('image', image, version), lambda : np.array(self.decode(image), dtype = float))
 
-    Members
-    -------
-    levels : 2D array-like
-        2D array of pixel level information. Note this is not pixel color; there should be some preprocessing
-        performed first, e.g. use class ImageProcessing. 
-    numlevels : Int
-        The maximum number of levels. Used to construct array counting frequency of levels in pixel level info.
-    '''
+        def makefilter():
+            levels = bw.copy()
+            ImageProcessing.bwtolevels(levels, 0, numlevels)
+            myfilter = self.filters[filtername](levels, numlevels)
+            myfilter.makebounds()
+            filterregistry.select(myfilter, numlevels)
+            return myfilter
 
-    def __init__(self, levels, numlevels):
+        return self.cached(('filter', image, version, numlevels, filtername), makefilter)
+
+    def render(self, image, numlevels, filtername):
         '''
-        Initializer
+        Build the tree for an image and return the positions of its leaves.
 
         Parameters
         ----------
         self : self
             Implicit reference to self.
-        levels : 2D array-like
-            2D array of pixel level info. Note this is not pixel color; there should be some preprocessing
-            performed first, e.g. use class ImageProcessing. 
+        image : String
+            The image name.
         numlevels : Int
-            The maximum number of levels. Used to construct array counting frequency of levels in pixel level info.
-        ''' 
+            The maximum level of Hilbert pseudo-curve.
+        filtername : String
+            A key of self.filters.
 
-        super().__init__(levels)
-        self.numlevels = numlevels
+        Returns
+        -------
+        List of Array-like
+            The leaf positions in curve order.
+        '''
+        myfilter = self.getfilter(image, numlevels, filtername)
+        tree = HilbertTreeMaxed(SquareSymmetry(0,0), 0, [0,0], myfilter.imwidth, myfilter.imheight,
+                                myfilter.filterfunc, myfilter.boundfunc)
+        tree.generatechildren(numlevels)
+        positions = []
+        tree.generatepositions(positions)
+        with self.lock:
+            self.nbuilds += 1
+        return positions
 
-    def filterfunc(self, pos, width, height):
+    def submit(self, image, numlevels, filtername):
         '''
-        Function to determine max level Hilbert pseudo-curve for given sub-rectangle. Use the majority pixel level
-        for the pixel data contained within the sub-rectangle. There is also a filter involving meeting a minimum
-        percent of the given pixels. If none of the levels meets the minimum floor, then it returns the max
-        level, insuring the sub-rectangle will be sub-divided if it isn't at the max level. 
-        
+        Handle one request as part of a batch. The first request for an image waits self.batchwindow seconds,
+        and then handles all of the requests for the same image that arrived in the meantime. Requests
+        with the same number of levels and filter share the same result. Requests for images outside of
+        self.imageroot or for more than self.maxlevels levels raise a ValueError.
+
         Parameters
         ----------
         self : self
             Implicit reference to self.
-        pos : Array-like
-            Should be array-like containing two floating point values representing the x and y coordinate of
-            the position of the sub-rectangle.
-        width : Float
-            The width of the sub-rectangle.
-        height : Float
-            The height of the sub-rectangle.
+        image : String
+            The image name.
+        numlevels : Int
+            The maximum level of Hilbert pseudo-curve.
+        filtername : String
+            A key of self.filters.
 
         Returns
         -------
-        Int
-            The majority level among the pixel level data for the pixels that are inside the sub-rectangle if the
-            majority is above a certain floor percentage; else, return the max number of levels in the tree.
+        List of Array-like
+            The leaf positions in curve order.
         '''
-        floorpercent = 0.99
-        minreturn = 0 # numlevels-3 
-    
-        dx = 1
-        dy = 1
-        self.setupxy(pos, width, height)
-        
-        frequency = [0 for i in range(self.numlevels+1)]
-        nvalues = 0
-        for i in range(self.x0, self.x1, dx):
-            for j in range(self.y0, self.y1, dy):
-                k = self.levels[j][i]
-                k = max(0.0, k)
-                k = int(k)
-                k = min(len(frequency), k)
-                frequency[k] += 1
-                nvalues += 1
-        result = 0
-        maxfrequency = 0
-        someabovefloor = False
-        floor = nvalues * floorpercent
-        for i in range(len(frequency)):
-            if frequency[i] >= maxfrequency:
-                maxfrequency = frequency[i]
-                result = i
-            if frequency[i] > floor:
-                someabovefloor = True
-        if someabovefloor:
-            if result > minreturn:
-                return result
-            else:
-                return minreturn
-        else:
-            return self.numlevels+1
+        if numlevels < 0 or numlevels > self.maxlevels:
+            raise ValueError('numlevels must be between 0 and ' + str(self.maxlevels))
+        image = self.imagepath(image)
+        request = {'numlevels' : numlevels, 'filter' : filtername, 'done' : threading.Event(),
+                   'positions' : None, 'error' : None}
+        with self.lock:
+            self.nrequests += 1
+            batch = self.pending.get(image)
+            leader = batch is None
+            if leader:
+                batch = []
+                self.pending[image] = batch
+            batch.append(request)
 
-class CircleFilter(LevelFilter):
-    '''
-    Class for creating a max level Hilbert pseudo-curve function that is for drawing randomly
-    placed circles of random radius and random level. Parent class is class LevelFilter.
+        if leader:
+            time.sleep(self.batchwindow)
+            with self.lock:
+                del self.pending[image]
+                self.nbatches += 1
+            results = {}
+            for member in batch:
+                key = (member['numlevels'], member['filter'])
+                if key not in results:
+                    try:
+                        results[key] = (self.render(image, member['numlevels'], member['filter']), None)
+                    except Exception as error:
+                        results[key] = (None, error)
+                (member['positions'], member['error']) = results[key]
+                member['done'].set()
 
-    Members
-    -------
-    self.levels : 2D array-like
-        Ignored.
-    self.maxlevel : Int
-        Maximum possible level for Hilbert pseudo-curves.
-    self.treewidth : Float
-        Width of rectangular drawing area to put circles.
-    self.treeheight : Float
-        Height of rectangular drawing area to put circles.
-    self.circles : Array-like
-        Each member represents one cirlce. Members are array-likes holding the x position, 
-        y position, radius, and level info of circle.
-    '''
+        request['done'].wait()
+        if request['error'] is not None:
+            raise request['error']
+        return request['positions']
 
-    def __init__(self, levels, maxlevel, treewidth, treeheight):
+    def handle(self, rfile, wfile):
         '''
-        Initializer. Creates the list of circles.
-        
+        Read one request from a connection and stream the answer back.
+
         Parameters
         ----------
         self : self
             Implicit reference to self.
-        levels : Int
-            Parameter passed to parent class.
-        maxlevel : Int
-            The maximum level of Hilbert pseudo-curve that a circle will be filled with.
-        treewdith : Float
-            The width of the rectangular area to draw the circles inside.
-        treeheight : Float
-            The height of the rectangular area to draw the circles inside.
+        rfile : File-like
+            Binary stream to read the request from.
+        wfile : File-like
+            Binary stream to write the answer to.
         '''
+        try:
+            request = json.loads(rfile.readline().decode('utf-8'))
+            positions = self.submit(request['image'], int(request['numlevels']),
+                                    request.get('filter', 'majority'))
+        except Exception as error:
+            wfile.write((json.dumps({'error' : str(error)}) + '\n').encode('utf-8'))
+            return
 
-        super().__init__(levels)
+        for start in range(0, len(positions), self.chunksize):
+            chunk = [[float(x), float(y)] for (x, y) in positions[start : start + self.chunksize]]
+            wfile.write((json.dumps({'positions' : chunk}) + '\n').encode('utf-8'))
+        wfile.write((json.dumps({'done' : True, 'numleaves' : len(positions)}) + '\n').encode('utf-8'))
 
-        maxradius = np.sqrt(treewidth**2 + treeheight**2) / 3.0
-        floor = 3
-        self.circles = []
-        for i in range(15):
-            radius = random.random()* maxradius
-            xcenter = random.random()*treewidth
-            ycenter = random.random()*treeheight
-            circlelevel = maxlevel - floor + random.random() * floor
-            self.circles.append([xcenter, ycenter, radius, circlelevel])
-    
-    def circlepointmax(self, pos):
+    def start(self):
         '''
-        Given an (x,y) position, find the highest level such that the position is contained in a circle
-        of that level. 
-        
+        Start listening on self.socketpath in a background thread. Each connection is handled in its own
+        thread. Removes a stale socket file first.
+
         Parameters
         ----------
         self : self
             Implicit reference to self.
-        pos : Array-like
-            Should contain two members of floating point values representing the x and y coordinate of the point.
-        
-        Returns
-        -------
-        Int 
-            The largest level such that the point is contained in a circle of that level.
         '''
-        result = 0
-        for i in range(len(self.circles)):
-            thiscircle = self.circles[i]
-            dist = 0.0
-            for j in range(2):
-                dist += (pos[j] - thiscircle[j])**2
-            dist = np.sqrt(dist)
-            if dist < thiscircle[2] and thiscircle[3]>result:
-                result = thiscircle[3]
-        return result
-    
-    def filterfunc(self, pos, width, height):
+        worker = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                worker.handle(self.rfile, self.wfile)
+
+        if os.path.exists(self.socketpath):
+            os.remove(self.socketpath)
+        self.server = socketserver.ThreadingUnixStreamServer(self.socketpath, Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+
+    def stop(self):
         '''
-        Find the largest level of Hilbert pseudo-curve for a given sub-rectangle. This really only depends
-        on the position of the sub-rectangle. Its level is given by the largest level of circle containing the
-        position.
+        Stop listening and remove the socket file.
 
         Parameters
         ----------
         self : self
             Implicit reference to self.
-        pos : Array-like
-            Should contain two members of floating point type representing the (x,y) position of the
-            sub-rectangle.
-        width : Float
-            The width of the sub-rectangle.
-        heigh : Float
-            The height of the sub-rectangle.
+        '''
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        if os.path.exists(self.socketpath):
+            os.remove(self.socketpath)
 
-        Returns
-        -------
-        Int
-            The largest level of Hilbert pseudo-curve associated to the sub-rectangle.
+class RenderClient:
+    '''
+    Class for sending requests to a RenderWorker over its Unix socket.
+
+    Members
+    -------
+    self.socketpath : String
+        The path of the Unix socket of the worker.
+    '''
+
+    def __init__(self, socketpath):
         '''
-        ncheck = 5
-        result = 0
-        dx = width / ncheck    
-        dy =  height / ncheck 
+        Initializer.
 
-        checkx = pos[0]
-        checky = pos[1]
-        for i in range(ncheck):
-            for j in range(ncheck):
-                checkpos = [checkx, checky]
-                circlelevel = self.circlepointmax(checkpos) 
-                if circlelevel > result:
-                    result = circlelevel 
-                checky += dy
-            checkx += dx
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        socketpath : String
+            The path of the Unix socket of the worker.
+        '''
+        self.socketpath = socketpath
 
-        return result
+    def curve(self, image, numlevels, filtername = 'majority'):
+        '''
+        Generator that requests the curve for an image and yields its positions as they are streamed back.
 
+        Parameters
+        ----------
+        self : self
+            Implicit reference to self.
+        image : String
+            The image name, a path relative to the image root of the worker.
+        numlevels : Int
+            The maximum level of Hilbert pseudo-curve.
+        filtername : String
+            Either 'max', 'average', or 'majority'.
 
+        Returns
+        -------
+        Generator of List of Float
+            The positions of the curve in order.
+        '''
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(self.socketpath)
+            request = {'image' : image, 'numlevels' : numlevels, 'filter' : filtername}
+            connection.sendall((json.dumps(request) + '\n').encode('utf-8'))
+            with connection.makefile('rb') as answer:
+                for line in answer:
+                    message = json.loads(line.decode('utf-8'))
+                    if 'error' in message:
+                        raise RuntimeError(message['error'])
+                    if message.get('done'):
+                        return
+                    yield from message['positions']
+        raise RuntimeError('connection closed before the curve was finished')
@@ -70,18 +70,39 @@ plt.show()
 #myfilter = hd.CircleFilter(bwvalues, numlevels, treewidth, treeheight)
 myfilter = hd.UseMajority(bwvalues, numlevels)
 
-# Using the filter function, set up the root Hilbert Tree node, and then generate the rest of the tree.
-squaretree = hd.HilbertTreeMaxed(initsymmetry, 0, [0,0], treewidth, treeheight, myfilter.filterfunc) 
-squaretree.generatechildren(numlevels)
+# Choose the fastest implementation of the filter for this image size and number of levels. It is
+# checked against the reference implementation on a sample of sub-rectangles first.
+print('Using the', hd.filterregistry.select(myfilter, numlevels), 'filter engine')
 
-# Now extract the positions of the leaf node from the Hilbert tree.
-positions = []
-squaretree.generatepositions(positions)
+# Precompute coarse bounds on the pixel levels so that some sub-rectangles can be decided without
+# running the whole filter on them.
+myfilter.makebounds()
 
+# For very large images, UseAverage and UseMajority can instead estimate the decision for big 
+# sub-rectangles from a random sample of their pixels, falling back to the exact filter when unsure.
+#myfilter.usesampling()
 
-# Graph line segments between adjacent leaf node positions in the positions list.
-xpoints = [positions[i][0] for i in range(len(positions))]
-ypoints = [treeheight-positions[i][1] for i in range(len(positions))]
+# Using the filter function, set up the root Hilbert Tree node, and then generate the rest of the tree.
+squaretree = hd.HilbertTreeMaxed(initsymmetry, 0, [0,0], treewidth, treeheight, myfilter.filterfunc, 
+                                 myfilter.boundfunc) 
+squaretree.generatechildren(numlevels)
+print('Decided', myfilter.nbounded, 'sub-rectangles using bounds and', myfilter.nunbounded, 'using the filter')
+
+# Now extract the positions of the leaf node from the Hilbert tree into an array with one row per leaf.
+positions = squaretree.generatepositionarray()
+
+# Export the curve for a pen plotter. Collinear moves are merged and the path is simplified
+# to within a tolerance smaller than the smallest leaf sub-rectangle.
+plotter = hd.PlotterExport('gcode', tolerance = 0.25 * treewidth / 2**(numlevels+1))
+with open('Output.gcode', 'w') as gcodefile:
+    reduction = plotter.export(squaretree.iteratepositions(), gcodefile)
+print('Saved Output.gcode with', plotter.nmovesout, 'moves instead of', plotter.nmovesin,
+      '(' + str(round(100 * reduction)) + '% fewer)')
+
+# Graph line segments between adjacent leaf node positions in the positions array. The columns
+# of the array are views, so the x points aren't copied.
+xpoints = positions[:, 0]
+ypoints = treeheight - positions[:, 1]
 
 fig = plt.figure(dpi = 300, frameon = False)
 plt.plot(xpoints, ypoints, color = "blue")